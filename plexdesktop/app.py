@@ -29,6 +29,7 @@ import plexdesktop.settings
 import plexdesktop.extra_widgets
 import plexdesktop.sqlcache
 import plexdesktop.components
+import plexdesktop.workers
 
 
 def run(log_level=logging.DEBUG):
@@ -106,8 +107,15 @@ def run(log_level=logging.DEBUG):
     qfd.addApplicationFont('resources/fonts/OpenSans-SemiboldItalic.ttf')
     qfd.addApplicationFont('resources/fonts/OpenSans-LightItalic.ttf')
 
+    cache_maintenance = plexdesktop.workers.CacheMaintenance.Instance()
+    app.aboutToQuit.connect(cache_maintenance.quit)
+    cache_maintenance.trim_all()
+
     cm = plexdesktop.components.ComponentManager.Instance()
-    cm.create_component(plexdesktop.extra_widgets.DownloadManager, 'download_manager')
+    app.aboutToQuit.connect(cm.fetch_service.quit)
+    download_manager = cm.create_component(plexdesktop.extra_widgets.DownloadManager,
+                                           'download_manager')
+    app.aboutToQuit.connect(download_manager.scheduler.quit)
     cm.create_browser()
 
     exit_code = app.exec_()
@@ -36,6 +36,7 @@ import plexdesktop.player
 import plexdesktop.player_default
 import plexdesktop.remote
 import plexdesktop.browserlist
+import plexdesktop.workers
 
 logger = logging.getLogger('plexdesktop')
 
@@ -96,6 +97,10 @@ class Browser(plexdesktop.components.ComponentWindow):
         self.ui.sort.addItem('Duration (long)', 'duration:desc')
         self.ui.sort.addItem('Duration (short)', 'duration:asc')
 
+        self.ui.menuEdit.addSeparator()
+        self.ui.menuEdit.addAction(self.ui.actionTrim_Thumb_Cache)
+        self.ui.menuEdit.addAction(self.ui.actionTrim_Image_Cache)
+
         # Hide things
         self.ui.hub_dock.hide()
         self.ui.hub_search.hide()
@@ -109,10 +114,23 @@ class Browser(plexdesktop.components.ComponentWindow):
         self.initial_load()
         # self.run_later(0, self.initial_load)
 
+    def changeEvent(self, event):
+        super().changeEvent(event)
+        if event.type() == QtCore.QEvent.ActivationChange and self.isActiveWindow():
+            self.set_foreground_tab()
+
+    def set_foreground_tab(self):
+        """Let the current tab's fetches go ahead of other tabs and windows."""
+        tab = self.ui.tabs.currentWidget()
+        if tab:
+            cm = plexdesktop.components.ComponentManager.Instance()
+            cm.fetch_service.set_foreground(tab.model())
+
     def tab_changed(self, index):
         tab = self.ui.tabs.widget(index)
         if not tab:
             return
+        self.set_foreground_tab()
         self.ui.actionView_Mode.disconnect()
         self.ui.actionView_Mode.triggered.connect(tab.toggle_view_mode)
         self.ui.zoom.disconnect()
@@ -163,10 +181,10 @@ class Browser(plexdesktop.components.ComponentWindow):
             self.action_reload_stylesheet)
         self.ui.actionAdd_Server.triggered.connect(
             self.action_manual_add_server)
-        # self.ui.actionTrim_Image_Cache.triggered.connect(
-        #     self.action_trim_image_cache)
-        # self.ui.actionTrim_Thumb_Cache.triggered.connect(
-        #     self.action_trim_thumb_cache)
+        self.ui.actionTrim_Image_Cache.triggered.connect(
+            self.action_trim_image_cache)
+        self.ui.actionTrim_Thumb_Cache.triggered.connect(
+            self.action_trim_thumb_cache)
         self.ui.actionRefresh_Devices.triggered.connect(
             self.action_refresh_devices)
         self.ui.actionRefresh_Users.triggered.connect(
@@ -411,13 +429,13 @@ class Browser(plexdesktop.components.ComponentWindow):
         style = plexdesktop.style.Style.Instance()
         style.refresh()
 
-    # @QtCore.pyqtSlot()
-    # def action_trim_image_cache(self):
-    #     plexdesktop.sqlcache.DB_IMAGE.remove()
+    @QtCore.pyqtSlot()
+    def action_trim_image_cache(self):
+        plexdesktop.workers.CacheMaintenance.Instance().trim.emit('image')
 
-    # @QtCore.pyqtSlot()
-    # def action_trim_thumb_cache(self):
-    #     plexdesktop.sqlcache.DB_THUMB.remove()
+    @QtCore.pyqtSlot()
+    def action_trim_thumb_cache(self):
+        plexdesktop.workers.CacheMaintenance.Instance().trim.emit('thumb')
 
     @QtCore.pyqtSlot()
     def action_refresh_devices(self):
@@ -535,9 +553,10 @@ class Browser(plexdesktop.components.ComponentWindow):
         with plexdesktop.sqlcache.db_thumb() as cache:
             for index, user in enumerate(session.users):
                 self.ui.users.addItem(user.title, user)
-                if user.thumb in cache:
+                img_data = cache.get(user.thumb)
+                if img_data is not None:
                     img = QtGui.QPixmap()
-                    img.loadFromData(cache[user.thumb])
+                    img.loadFromData(img_data)
                     icon = QtGui.QIcon(img)
                     self.ui.users.setItemIcon(index, icon)
                 logger.debug('{} {}'.format(user.title, user))
@@ -15,6 +15,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import time
+import collections
 
 import plexdevices
 
@@ -25,17 +27,16 @@ import plexdesktop.utils
 import plexdesktop.workers
 import plexdesktop.extra_widgets
 import plexdesktop.delegates
+import plexdesktop.prefetch
+import plexdesktop.rows
+import plexdesktop.sqlcache
+from plexdesktop.settings import Settings
 
 logger = logging.getLogger('plexdesktop')
 
 
 class ListModel(QtCore.QAbstractListModel):
-    work_container = QtCore.pyqtSignal(plexdevices.device.Device,
-                                       str, int, int, str, dict)
-    work_container_fetch_more = QtCore.pyqtSignal(plexdevices.media.MediaContainer)
     work_container_fetch_next_page = QtCore.pyqtSignal(plexdevices.media.MediaContainer)
-    work_thumb = QtCore.pyqtSignal(plexdevices.media.BaseObject, int)
-    work_thumbs = QtCore.pyqtSignal(plexdesktop.utils.Queue)
 
     # new_item = QtCore.pyqtSignal(QtCore.QModelIndex)
     new_container_titles = QtCore.pyqtSignal(str, str)
@@ -45,52 +46,60 @@ class ListModel(QtCore.QAbstractListModel):
     working = QtCore.pyqtSignal()
     done = QtCore.pyqtSignal()
 
+    # loaded pages kept either side of the ones in view
+    KEEP_PAGES = 3
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.container = None
-
-        self.container_thread = QtCore.QThread()
-        self.thumb_thread = QtCore.QThread()
+        # row records for an unpaged container
+        self._rows = []
+        # page number -> (items, row records), or None when the container
+        # isn't paged
+        self._pages = None
+        self._page_size = 0
+        self._requested_pages = set()
+        self._location = None
+        self._next_location = (None, 0)
+        self._generation = 0
+        # id and arguments of the newest container request
+        self._request_id = 0
+        self._in_flight = None
+        # more rows of the container are on their way
+        self.streaming = False
+
+        # the worker's methods run on the shared fetch service's threads
+        self.fetch_service = plexdesktop.components.ComponentManager.Instance().fetch_service
         self.container_worker = plexdesktop.workers.ContainerWorker()
-        self.thumb_worker = plexdesktop.workers.QueueThumbWorker()
-        self.container_worker.moveToThread(self.container_thread)
-        self.thumb_worker.moveToThread(self.thumb_thread)
+        self.thumb_worker = plexdesktop.workers.QueueThumbWorker(self)
 
         self.container_worker.result_ready.connect(self._add_container)
+        self.container_worker.result_updated.connect(self._refresh_container)
+        self.container_worker.stream_started.connect(self._start_stream)
+        self.container_worker.rows_ready.connect(self._add_rows)
         self.container_worker.container_updated.connect(self._update_container)
+        self.container_worker.page_ready.connect(self._add_page)
+        self.container_worker.page_failed.connect(self._page_failed)
+        self.container_worker.request_done.connect(self._request_done)
         self.container_worker.finished.connect(self._done)
 
         self.thumb_worker.result_ready.connect(self._update_thumb)
+        # rows with new thumbs, repainted together once per event loop pass
+        self._changed_thumbs = set()
+        self._thumb_timer = QtCore.QTimer(self)
+        self._thumb_timer.setSingleShot(True)
+        self._thumb_timer.setInterval(0)
+        self._thumb_timer.timeout.connect(self._emit_thumbs_changed)
 
-        self.work_container.connect(self.container_worker.run)
-        self.work_container.connect(self.working.emit)
-        self.work_container_fetch_more.connect(self.container_worker.fetch_more)
-        self.work_container_fetch_more.connect(self.working.emit)
         # self.work_container_fetch_next_page.connect(self.container_worker.fetch_next_page_object)
         # self.work_container_fetch_next_page.connect(self.working.emit)
 
-        # self.work_thumb.connect(self.thumb_worker.get_thumb)
-        self.work_thumbs.connect(self.thumb_worker.process)
-
-        self.thumb_queue = plexdesktop.utils.Queue()
-
-        self.container_thread.start()
-        self.thumb_thread.start()
-        self.work_thumbs.emit(self.thumb_queue)
-
     def quit(self):
-        self.thumb_queue.clear()
-        self.thumb_queue.put(None)
-
-        self.container_thread.quit()
-        self.container_thread.wait()
-        self.thumb_thread.quit()
-        self.thumb_thread.wait()
-
-        self.container_worker.deleteLater()
+        self.thumb_worker.quit()
+        # a fetch that's already running keeps the worker alive until it's
+        # done, its results go nowhere once the model is gone
+        self.fetch_service.forget(self)
         self.thumb_worker.deleteLater()
-        self.container_thread.deleteLater()
-        self.thumb_thread.deleteLater()
 
     def _done(self):
         if self.container:
@@ -98,67 +107,307 @@ class ListModel(QtCore.QAbstractListModel):
             self.new_container_titles.emit(t1, t2)
         self.done.emit()
 
-    def _add_container(self, container):
+    def _add_container(self, request_id, container, count=None):
+        """Show `container`. `count` is how many items the response has if
+        they aren't all in it yet."""
+        if request_id != self._request_id:
+            logger.debug('ListModel: dropping superseded container')
+            return False
+        self._in_flight = None
+        self.streaming = False
+        self.beginResetModel()
+        self.thumb_worker.clear()
+        self._changed_thumbs.clear()
+        self._requested_pages.clear()
+        self._generation += 1
+        self._location, self._page_size = self._next_location
         self.container = container
-        for i in range(len(self.container)):
-            index = self.index(i)
-            self._queue_thumb(self.data(index, QtCore.Qt.UserRole), index.row())
+        count = len(container) if count is None else count
+        if (self._page_size and count == self._page_size and
+                container.total_size > count and
+                not self._channel_paging()):
+            self._pages = {0: self._page(container)}
+            self._rows = []
+        else:
+            self._pages = None
+            self._rows = [plexdesktop.rows.Row(item) for item in container.children]
         self.endResetModel()
         self.new_container.emit()
+        return True
+
+    def _refresh_container(self, request_id, container):
+        """A newer copy of the container shown from the metadata index. If it
+        has the same items they're replaced in place, so the view keeps its
+        scroll position and selection."""
+        if request_id != self._request_id or self.container is None:
+            return
+        if (container.total_size != self.container.total_size or
+                [item.key for item in container.children] !=
+                [item.key for item in self.container.children]):
+            self._add_container(request_id, container)
+            return
+        self.container = container
+        if self._pages is None:
+            self._rows = [plexdesktop.rows.Row(item) for item in container.children]
+        else:
+            self._pages[0] = self._page(container)
+        if len(container):
+            self.dataChanged.emit(self.index(0), self.index(len(container) - 1))
+        self.new_page.emit()
+
+    def forget_index(self, item=None):
+        """Drop the container shown from the metadata index, e.g. when one of
+        its items has been played or marked watched."""
+        if self._location is None or not self._page_size:
+            return
+        server, key, sort, params = self._location
+        p = {} if not sort else {'sort': sort}
+        if params:
+            p.update(params)
+        plexdesktop.sqlcache.forget_index(server, key, 0, self._page_size, p)
+
+    def _start_stream(self, request_id, container):
+        """The first part of a container that's still being parsed, the rest
+        follows with :meth:`_add_rows`."""
+        count = int(container.data.get('size', len(container)))
+        if self._add_container(request_id, container, count):
+            self.streaming = True
+
+    def _add_rows(self, request_id, container, last):
+        """Append the items of `container`, the next part of the one being
+        streamed, to it."""
+        if request_id != self._request_id or not self.streaming:
+            return
+        if last:
+            self.streaming = False
+            if self._pages is not None and len(self._pages[0][0]) < self._page_size:
+                # the response broke off, the rest of page 0 comes as a page
+                self._request_page(0)
+            return
+        items = container.children
+        if not items:
+            return
+        for item in items:
+            item.container = self.container
+        rows = [plexdesktop.rows.Row(item) for item in items]
+        if self._pages is None:
+            first = len(self.container)
+            self.beginInsertRows(QtCore.QModelIndex(), first, first + len(items) - 1)
+            self.container.children.extend(items)
+            self._rows.extend(rows)
+            self.endInsertRows()
+        else:
+            # page 0's items are the container's children
+            page_items, page_rows = self._pages[0]
+            first = len(page_items)
+            page_items.extend(items)
+            page_rows.extend(rows)
+            self.dataChanged.emit(self.index(first), self.index(first + len(items) - 1))
+        self.new_page.emit()
+
+    def shown_location(self):
+        """The (server, Location) of the container being shown, which isn't
+        the view's location while a new one is loading."""
+        if self._location is None:
+            return None, None
+        server, key, sort, params = self._location
+        return server, plexdesktop.utils.Location(key, sort, params)
+
+    def state(self):
+        """Return what's needed to show the current container again later
+        with :meth:`restore_state`."""
+        return (self.container, self._rows, self._pages, self._location,
+                self._page_size)
+
+    def restore_state(self, state):
+        self._cancel_fetch()
+        self.streaming = False
+        self.beginResetModel()
+        self.thumb_worker.clear()
+        self._changed_thumbs.clear()
+        self._requested_pages.clear()
+        self._generation += 1
+        (self.container, self._rows, self._pages, self._location,
+         self._page_size) = state
+        self.endResetModel()
+        self.new_container.emit()
+        self._done()
 
     def _update_container(self, container, count):
-        for i in range(len(container) - count, len(container)):
-            index = self.index(i)
-            self._queue_thumb(self.data(index, QtCore.Qt.UserRole), index.row())
+        self._rows.extend(plexdesktop.rows.Row(item) for item in
+                          container.children[len(self._rows):])
         self.endInsertRows()
         self.new_page.emit()
 
-    @QtCore.pyqtSlot(int, object)
-    def _update_thumb(self, row, media_item):
-        index = self.index(row)
-        if media_item == self.data(index, QtCore.Qt.UserRole):
-            # delattr(media_item, 'thumb_queued')
-            self.setData(index, None, role=QtCore.Qt.DecorationRole)
+    def _add_page(self, generation, page, container):
+        if generation != self._generation or self._pages is None:
+            return
+        self._requested_pages.discard(page)
+        self._pages[page] = self._page(container)
+        first = page * self._page_size
+        last = min(first + len(container), self.rowCount()) - 1
+        if last >= first:
+            self.dataChanged.emit(self.index(first), self.index(last))
+        self.new_page.emit()
 
-    def _queue_thumb(self, item, row):
-        QtGui.QPixmapCache.insert(item.thumb, QtGui.QPixmap())
-        self.thumb_queue.put((item, row))
+    def _page_failed(self, generation, page):
+        if generation == self._generation:
+            self._requested_pages.discard(page)
 
-    def fetch_container(self, server, key, page=0, size=50, sort="", params={}):
-        self.thumb_queue.clear()
-        self.beginResetModel()
-        self.work_container.emit(server, key, page, size, sort, params)
+    def _request_page(self, page):
+        if page in self._requested_pages:
+            return
+        self._requested_pages.add(page)
+        server, key, sort, params = self._location
+        self.working.emit()
+        self.fetch_service.submit(self, self.container_worker.fetch_page,
+                                  server, key, page, self._page_size,
+                                  sort, params, self._generation)
+
+    def request_rows(self, first, last):
+        """Load the pages holding rows `first` to `last` and drop the ones
+        far away from them."""
+        if self._pages is None:
+            return
+        first_page = max(0, first) // self._page_size
+        last_page = max(0, min(last, self.rowCount() - 1)) // self._page_size
+        for page in range(first_page, last_page + 1):
+            if page not in self._pages:
+                self._request_page(page)
+        for page in list(self._pages):
+            # page 0 is the container itself, so dropping it frees nothing
+            if page and not (first_page - self.KEEP_PAGES <= page <=
+                             last_page + self.KEEP_PAGES):
+                del self._pages[page]
+
+    def next_pages(self, row, count=1):
+        """Arguments of ``ContainerWorker.fetch_page`` for up to `count` pages
+        after the one holding `row` that aren't loaded or on their way."""
+        if self._pages is None or not self.rowCount():
+            return []
+        server, key, sort, params = self._location
+        last_page = (self.rowCount() - 1) // self._page_size
+        pages = [page for page in range(max(0, row) // self._page_size + 1, last_page + 1)
+                 if page not in self._pages and page not in self._requested_pages]
+        return [(server, key, page, self._page_size, sort, params, self._generation)
+                for page in pages[:count]]
+
+    @staticmethod
+    def _page(container):
+        return (container.children,
+                [plexdesktop.rows.Row(item) for item in container.children])
+
+    def _lookup(self, row):
+        if self.container is None or row < 0:
+            return (), (), 0
+        if self._pages is None:
+            return self.container.children, self._rows, row
+        items, rows = self._pages.get(row // self._page_size, ((), ()))
+        return items, rows, row % self._page_size
+
+    def item(self, row):
+        """Return the item at `row`, or None if its page isn't loaded."""
+        items, _, offset = self._lookup(row)
+        return items[offset] if offset < len(items) else None
+
+    def row_record(self, row):
+        """Return the :class:`plexdesktop.rows.Row` for `row`, or None if
+        its page isn't loaded."""
+        _, rows, offset = self._lookup(row)
+        return rows[offset] if offset < len(rows) else None
+
+    @QtCore.pyqtSlot(int, object)
+    def _update_thumb(self, row, media_item):
+        # not data(), which would fetch the page again if it's been dropped
+        if media_item == self.item(row):
+            self._changed_thumbs.add(row)
+            if not self._thumb_timer.isActive():
+                self._thumb_timer.start()
+
+    def _emit_thumbs_changed(self):
+        rows, self._changed_thumbs = self._changed_thumbs, set()
+        for first, last in plexdesktop.utils.contiguous_ranges(rows):
+            self.dataChanged.emit(self.index(first), self.index(last),
+                                  [QtCore.Qt.DecorationRole])
+
+    def request_thumbs(self, first, last, prefetch=0):
+        """Load the thumbs for rows `first` to `last` before any others, then
+        up to `prefetch` rows either side of them."""
+        self.thumb_worker.set_window(first, last, prefetch)
+        if self.container is None:
+            return
+        for row in range(max(0, first - prefetch),
+                         min(self.rowCount(), last + prefetch + 1)):
+            item = self.item(row)
+            if item is not None and item.thumb and not self.thumb_worker.cached(item):
+                self.thumb_worker.get_thumb(item, row)
+
+    def fetch_container(self, server, key, page=0, size=50, sort="", params={},
+                        fresh=False):
+        # the current items stay up until the new container arrives, which
+        # can be straight away if it's in the metadata index and not `fresh`.
+        # only containers opened at the start are paged, see _add_container
+        request = (server, key, page, size, sort, params)
+        if request == self._in_flight and not fresh:
+            return
+        self._cancel_fetch()
+        self._in_flight = request
+        self._next_location = ((server, key, sort, params),
+                               size if page == 0 else 0)
+        self.working.emit()
+        self.fetch_service.submit(self, self.container_worker.run,
+                                  server, key, page, size, sort, params,
+                                  self._request_id, fresh, key='container')
+
+    def _request_done(self, request_id):
+        # a request that failed can be made again
+        if request_id == self._request_id:
+            self._in_flight = None
+
+    def _cancel_fetch(self):
+        """Supersede the container request in flight. The worker skips it if
+        it hasn't started and its result is dropped if it has."""
+        self._request_id += 1
+        self._in_flight = None
+        self.container_worker.latest = self._request_id
 
     def rowCount(self, parent=QtCore.QModelIndex()):
-        return 0 if self.container is None else len(self.container)
+        if self.container is None:
+            return 0
+        if self._pages is None:
+            return len(self.container)
+        return self.container.total_size
 
     def data(self, index, role=QtCore.Qt.DisplayRole):
         if self.container is None:
             return QtCore.QVariant()
+        row = index.row()
+        item = self.item(row)
+        if item is None:
+            page = row // max(1, self._page_size)
+            if (self._pages is not None and page not in self._pages and
+                    0 <= row < self.rowCount()):
+                self._request_page(page)
+            return QtCore.QVariant()
         if role == QtCore.Qt.DisplayRole:
             try:
-                return self.container.children[index.row()].title
-            except (AttributeError, IndexError):
+                return item.title
+            except AttributeError:
                 return QtCore.QVariant()
         elif role == QtCore.Qt.UserRole:
-            try:
-                return self.container.children[index.row()]
-            except IndexError:
-                return QtCore.QVariant()
+            return item
+        elif role == plexdesktop.rows.ROW_ROLE:
+            return self.row_record(row)
         elif role == QtCore.Qt.DecorationRole:
-            row = index.row()
-            item = self.container.children[row]
-            if hasattr(item, 'thumb_queued'):
-                return QtCore.QVariant()
             key = item.thumb
             if not key:
                 return plexdesktop.delegates.placeholder_thumb_generator(item.title)
-            img = QtGui.QPixmapCache.find(key)
+            img = self.thumb_worker.cached(item)
             if img:
                 return img
-            self._queue_thumb(item, row)
-            # QtGui.QPixmapCache.insert(key, QtGui.QPixmap())
-            # self.thumb_queue.put((item, row))
+            if self.thumb_worker.failed(item):
+                return plexdesktop.delegates.placeholder_thumb_generator(item.title)
+            self.thumb_worker.get_thumb(item, row)
             return QtCore.QVariant()
         else:
             return QtCore.QVariant()
@@ -170,22 +419,33 @@ class ListModel(QtCore.QAbstractListModel):
             self.dataChanged.emit(index, index, [QtCore.Qt.DecorationRole])
             return True
         elif role == QtCore.Qt.UserRole:
+            # the item changed, e.g. it was marked watched
+            items, rows, offset = self._lookup(index.row())
+            plexdesktop.utils.invalidate_titles(items[offset])
+            rows[offset] = plexdesktop.rows.Row(items[offset])
             self.dataChanged.emit(index, index)
             return True
 
+    def _channel_paging(self):
+        """Channels page with a trailing 'paging' directory instead of
+        honouring the container start and size headers."""
+        last_item = self.container.children[-1]
+        return (isinstance(last_item, plexdevices.media.Directory) and
+                bool(int(last_item.data.get('paging', 0))))
+
     def canFetchMore(self, index):
-        if self.container is None or not len(self.container):
+        # a container that's streaming gets the rest of its rows that way
+        if (self.container is None or not len(self.container) or
+                self._pages is not None or self.streaming):
             return False
-        last_item = self.container.children[-1]
-        if isinstance(last_item, plexdevices.media.Directory) and bool(int(last_item.data.get('paging', 0))):
+        if self._channel_paging():
             return True
         return len(self.container) < self.container.total_size
 
     def fetchMore(self, parent):
-        if not self.container:
+        if not self.container or self._pages is not None or self.streaming:
             return
-        last_item = self.container.children[-1]
-        if isinstance(last_item, plexdevices.media.Directory) and bool(int(last_item.data.get('paging', 0))):
+        if self._channel_paging():
             self.beginInsertRows(
                 QtCore.QModelIndex(),
                 len(self.container),
@@ -198,7 +458,9 @@ class ListModel(QtCore.QAbstractListModel):
                 min(self.container.total_size,
                     len(self.container) + self.container._size) - 1
             )
-        self.work_container_fetch_more.emit(self.container)
+        self.working.emit()
+        self.fetch_service.submit(self, self.container_worker.fetch_more,
+                                  self.container)
 
 
 class BrowserTabs(QtWidgets.QTabWidget):
@@ -232,6 +494,7 @@ class BrowserTabs(QtWidgets.QTabWidget):
         view.metadata_selection.connect(self.browser.ui_update_metadata_panel)
         view.location_changed.connect(self.update_tab_text)
         view.download.connect(self.browser.download_manager.add)
+        view.download_all.connect(self.browser.download_manager.add_batch)
         view.iconSizeChanged.connect(self.browser.ui_update_zoom)
         view.location_changed.connect(self.browser.location_changed)
         view.server_changed.connect(self.browser.server_changed)
@@ -327,12 +590,16 @@ class BrowserTabs(QtWidgets.QTabWidget):
 #         self.remove.emit(self.sender().data())
 
 
+# a location left in a ListView, kept to go back or forward to it instantly
+NavEntry = collections.namedtuple('NavEntry', 'state top_row current_row time')
+
+
 class ListView(QtWidgets.QListView):
     viewModeChanged = QtCore.pyqtSignal()
     itemDoubleClicked = QtCore.pyqtSignal(plexdevices.media.BaseObject)
     itemSelectionChanged = QtCore.pyqtSignal(plexdevices.media.BaseObject)
     container_request = QtCore.pyqtSignal(plexdevices.device.Device,
-                                          str, int, int, str, dict)
+                                          str, int, int, str, dict, bool)
 
     queue = QtCore.pyqtSignal(plexdevices.media.BaseObject)
     play = QtCore.pyqtSignal(plexdevices.media.BaseObject)
@@ -343,6 +610,7 @@ class ListView(QtWidgets.QListView):
     metadata_selection = QtCore.pyqtSignal(plexdevices.media.BaseObject)
     new_titles = QtCore.pyqtSignal(str, str)
     download = QtCore.pyqtSignal(plexdevices.media.BaseObject, str)
+    download_all = QtCore.pyqtSignal(plexdevices.media.BaseObject, str)
 
     location_changed = QtCore.pyqtSignal(plexdesktop.utils.Location)
     server_changed = QtCore.pyqtSignal(plexdevices.device.Device)
@@ -369,6 +637,15 @@ class ListView(QtWidgets.QListView):
         self.min_icon_size = self.list_delegate.title_font_metrics.height()
         self.max_icon_size = 300
 
+        # find the visible rows once things settle after a scroll or resize
+        self.viewport_timer = QtCore.QTimer(self)
+        self.viewport_timer.setSingleShot(True)
+        self.viewport_timer.setInterval(50)
+        self.viewport_timer.timeout.connect(self.request_visible_thumbs)
+        self.verticalScrollBar().valueChanged.connect(self.viewport_timer.start)
+        self.iconSizeChanged.connect(self.viewport_timer.start)
+        self.viewModeChanged.connect(self.viewport_timer.start)
+
         self.doubleClicked.connect(self.double_click)
         self.container_request.connect(self.model().fetch_container)
         self.customContextMenuRequested.connect(self.context_menu)
@@ -379,15 +656,29 @@ class ListView(QtWidgets.QListView):
         self.model().done.connect(self.finished.emit)
         self.model().done.connect(self.check_view_mode)
         self.model().new_container_titles.connect(self.new_titles.emit)
+        self.model().new_container.connect(self.viewport_timer.start)
+        self.model().new_page.connect(self.viewport_timer.start)
+        # what's played gets a new view offset or count
+        self.play.connect(self.model().forget_index)
 
         self.location = plexdesktop.utils.Location.home()
         self.current_server = server
         self.history = [(self.current_server, self.location)]
         self.history_cursor = -1
+        # recently left locations, see remember_location
+        self.nav_cache = collections.OrderedDict()
 
         self.forced_toggle = False
 
+        # warms the caches while the user is idle, if it's turned on
+        self.prefetcher = plexdesktop.prefetch.Prefetcher(self)
+        self.verticalScrollBar().valueChanged.connect(self.prefetcher.poke)
+        self.container_request.connect(self.prefetcher.poke)
+        self.itemSelectionChanged.connect(self.prefetcher.poke)
+        self.model().working.connect(self.prefetcher.poke)
+
     def quit(self):
+        self.prefetcher.quit()
         self._model.quit()
         self._model.deleteLater()
         self.list_delegate.deleteLater()
@@ -409,9 +700,9 @@ class ListView(QtWidgets.QListView):
         else:
             super().wheelEvent(event)
 
-    # def resizeEvent(self, event):
-    #     self.visible_items()
-    #     super().resizeEvent(event)
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.viewport_timer.start()
 
     ########
     def clear_history(self):
@@ -426,7 +717,8 @@ class ListView(QtWidgets.QListView):
         self.goto_location(new_loc, history=False)
 
     def reload(self):
-        self.goto_location(self.location, history=False)
+        plexdesktop.utils.invalidate_titles()
+        self.goto_location(self.location, history=False, fresh=True)
 
     def go_home(self):
         self.history = [(self.current_server, plexdesktop.utils.Location.home())]
@@ -436,17 +728,69 @@ class ListView(QtWidgets.QListView):
 
     def go_back(self):
         if self.history_cursor > 0:
-            self.history_cursor -= 1
-            server, loc = self.history[self.history_cursor]
-            self.goto_location(loc, server, history=False)
+            self.goto_history(self.history_cursor - 1)
 
     def go_forward(self):
         if self.history_cursor < len(self.history) - 1:
-            self.history_cursor += 1
-            server, loc = self.history[self.history_cursor]
+            self.goto_history(self.history_cursor + 1)
+
+    def goto_history(self, cursor):
+        self.history_cursor = cursor
+        server, loc = self.history[self.history_cursor]
+        if not self.restore_location(loc, server):
             self.goto_location(loc, server, history=False)
 
-    def goto_location(self, location, server=None, history=True):
+    @staticmethod
+    def _nav_key(server, location):
+        # the model has '' and {} where a location has None
+        return (server.client_identifier if server else None, location.key,
+                location.sort or None, tuple(sorted((location.params or {}).items())))
+
+    def remember_location(self):
+        """Keep the current container, scroll position and selection so
+        going back or forward to it doesn't need the server. Not while it's
+        still loading, it would come back with only part of its rows."""
+        server, location = self.model().shown_location()
+        if self.model().container is None or self.model().streaming or location is None:
+            return
+        # keyed by what's shown: the view's location is already the next
+        # one while it loads
+        key = self._nav_key(server, location)
+        top = self.indexAt(QtCore.QPoint(0, 0))
+        self.nav_cache[key] = NavEntry(
+            self.model().state(), top.row() if top.isValid() else 0,
+            self.currentIndex().row(), time.monotonic())
+        self.nav_cache.move_to_end(key)
+        while len(self.nav_cache) > int(Settings().value('nav_cache_size', 10)):
+            self.nav_cache.popitem(last=False)
+
+    def restore_location(self, location, server):
+        """Show `location` as it was left if it's remembered and not older
+        than the nav_cache_age setting. Return False otherwise."""
+        entry = self.nav_cache.pop(self._nav_key(server, location), None)
+        max_age = float(Settings().value('nav_cache_age', 300))
+        if entry is None or time.monotonic() - entry.time > max_age:
+            return False
+        self.remember_location()
+        if server != self.current_server:
+            self.current_server = server
+            self.server_changed.emit(server)
+        self.location = location
+        self.model().restore_state(entry.state)
+        model = self.model()
+        self.scrollTo(model.index(entry.top_row),
+                      QtWidgets.QAbstractItemView.PositionAtTop)
+        if entry.current_row >= 0:
+            self.setCurrentIndex(model.index(entry.current_row))
+            self.scrollTo(model.index(entry.top_row),
+                          QtWidgets.QAbstractItemView.PositionAtTop)
+        self.location_changed.emit(location)
+        return True
+
+    def goto_location(self, location, server=None, history=True, fresh=False):
+        """Show `location`. If `fresh`, it's fetched from the server even if
+        it's in the metadata index."""
+        self.remember_location()
         if not location.key.startswith('/'):
             location.key = self.location.key + '/' + location.key
         logger.info('BrowserList: key=' + location.key)
@@ -468,7 +812,8 @@ class ListView(QtWidgets.QListView):
             page=0,
             size=100,
             sort=location.sort,
-            params=location.params
+            params=location.params,
+            fresh=fresh
         )
 
         # History
@@ -522,13 +867,17 @@ class ListView(QtWidgets.QListView):
     def icon_size(self, x):
         self.last_icon_size = QtCore.QSize(x, x)
         self.setIconSize(self.last_icon_size)
+        # thumbs scaled for the old size won't be painted again
+        self.list_delegate.thumb_cache.clear()
+        self.tile_delegate.thumb_cache.clear()
 
-    def add_container(self, server, key, page=0, size=50, sort=None, params=None):
+    def add_container(self, server, key, page=0, size=50, sort=None, params=None,
+                      fresh=False):
         if page == 0:
             self.scrollToTop()
         self.container_request.emit(server, key, page, size,
                                     sort if sort is not None else '',
-                                    params if params is not None else {})
+                                    params if params is not None else {}, fresh)
 
     def double_click(self, index):
         self.itemDoubleClicked.emit(index.data(role=QtCore.Qt.UserRole))
@@ -576,25 +925,34 @@ class ListView(QtWidgets.QListView):
     #     return (columns, rows)
 
     def visible_items(self):
+        """Return the first and last rows intersecting the viewport."""
         model = self.model()
         if not model.rowCount():
-            return (0, [])
-        rect = self.rect()
+            return (0, -1)
+        rect = self.viewport().rect()
 
         # columns, rows = self.update_batch_size()
 
-        visible = []
-
+        first = last = None
         start = self.indexAt(QtCore.QPoint(15, 15))
         for i in range(start.row() if start.isValid() else 0, model.rowCount()):
             index = model.index(i)
             if rect.intersects(self.visualRect(index)):
-                visible.append(index)
-            else:
-                if visible:
-                    break
-        # print(len(visible))
-        # self.request_thumbs.emit(visible)
+                if first is None:
+                    first = i
+                last = i
+            elif first is not None:
+                break
+        return (0, -1) if first is None else (first, last)
+
+    def request_visible_thumbs(self):
+        first, last = self.visible_items()
+        if last < first:
+            return
+        # prefetch about a screen's worth of rows in each direction
+        prefetch = last - first + 1
+        self.model().request_rows(first - prefetch, last + prefetch)
+        self.model().request_thumbs(first, last, prefetch=prefetch)
 
     def preferences_prompt(self, item):
         plexdesktop.extra_widgets.PreferencesObjectDialog(item, parent=self)
@@ -686,6 +1044,10 @@ class ListView(QtWidgets.QListView):
                 action = QtWidgets.QAction('Play all', menu)
                 action.triggered.connect(self.cm_play)
                 actions.append(action)
+                if item.container.is_library:
+                    action = QtWidgets.QAction('Download all', menu)
+                    action.triggered.connect(self.cm_save_all)
+                    actions.append(action)
 
                 if item.container.is_library:
                     for player in component_manager.players():
@@ -765,14 +1127,22 @@ class ListView(QtWidgets.QListView):
         item, index = self.sender().data()
         item.mark_watched()
         index.model().setData(index, None, QtCore.Qt.UserRole)
+        index.model().forget_index()
 
     def cm_mark_unwatched(self):
         item, index = self.sender().data()
         item.mark_unwatched()
         index.model().setData(index, None, QtCore.Qt.UserRole)
+        index.model().forget_index()
 
     def cm_save_item(self):
         item = self.sender().data()[0]
         save_dir = QtWidgets.QFileDialog.getExistingDirectory(self, 'Open Directory')
         if save_dir:
             self.download.emit(item, save_dir)
+
+    def cm_save_all(self):
+        item = self.sender().data()[0]
+        save_dir = QtWidgets.QFileDialog.getExistingDirectory(self, 'Open Directory')
+        if save_dir:
+            self.download_all.emit(item, save_dir)
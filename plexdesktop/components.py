@@ -21,6 +21,7 @@ from PyQt5 import QtCore, QtWidgets
 
 import plexdesktop.browser
 import plexdesktop.utils
+import plexdesktop.workers
 
 logger = logging.getLogger('plexdesktop')
 
@@ -55,6 +56,8 @@ class ComponentManager(QtCore.QObject):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.components = {}
+        # shared by every browser, tab and viewer
+        self.fetch_service = plexdesktop.workers.FetchService(self)
 
     def add(self, component):
         logger.debug('ComponentManager: adding {}'.format(component.name))
@@ -14,11 +14,11 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import plexdevices
+import collections
 
 from PyQt5 import QtWidgets, QtGui, QtCore
 
-from plexdesktop.utils import hub_title, title, timestamp_from_ms
+from plexdesktop.rows import ROW_ROLE
 from plexdesktop.settings import Settings
 
 
@@ -34,6 +34,67 @@ class BaseDelegate(QtWidgets.QStyledItemDelegate):
         self.title_font_metrics = QtGui.QFontMetrics(self.title_font)
         self.summary_font_metrics = QtGui.QFontMetrics(self.title_font)
         self.last_icon_size = self.parent().iconSize().height()
+        self.thumb_cache = ScaledThumbCache()
+
+    def scale_thumb(self, thumb, icon_size):
+        """return `thumb` scaled and cropped for `icon_size`"""
+        raise NotImplementedError
+
+    def scaled_thumb(self, row, thumb, icon_size):
+        """return the thumb to paint for `row`, scaling and decorating it
+        only if it isn't in the cache yet."""
+        key = (thumb.cacheKey(), icon_size.width(), icon_size.height(), row.state)
+        scaled = self.thumb_cache.find(key)
+        if scaled is None:
+            scaled = self.scale_thumb(thumb, icon_size)
+            if row.state is not None:
+                watched, in_progress, _ = row.state
+                if in_progress:
+                    draw_progress_bar(row.progress, scaled, height=6)
+                elif not watched:
+                    draw_unwatched_indicator(scaled, size=0.20)
+            self.thumb_cache.insert(key, scaled)
+        return scaled
+
+
+class ScaledThumbCache(object):
+    """A LRU cache of pixmaps that are ready to paint, limited to `limit` bytes."""
+
+    def __init__(self, limit=32 * 1024 * 1024):
+        self.limit = limit
+        self.size = 0
+        self.pixmaps = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.pixmaps)
+
+    def find(self, key):
+        try:
+            self.pixmaps.move_to_end(key)
+        except KeyError:
+            return None
+        return self.pixmaps[key]
+
+    def insert(self, key, pixmap):
+        self.remove(key)
+        self.pixmaps[key] = pixmap
+        self.size += self._cost(pixmap)
+        while self.size > self.limit and len(self.pixmaps) > 1:
+            _, old = self.pixmaps.popitem(last=False)
+            self.size -= self._cost(old)
+
+    def remove(self, key):
+        pixmap = self.pixmaps.pop(key, None)
+        if pixmap is not None:
+            self.size -= self._cost(pixmap)
+
+    def clear(self):
+        self.pixmaps.clear()
+        self.size = 0
+
+    @staticmethod
+    def _cost(pixmap):
+        return pixmap.width() * pixmap.height() * pixmap.depth() // 8
 
 
 def placeholder_thumb_generator(title, size=150):
@@ -62,14 +123,9 @@ def placeholder_thumb_generator(title, size=150):
     return img
 
 
-def draw_progress_bar(plex_item, pixmap, height=6):
+def draw_progress_bar(progress, pixmap, height=6):
     """draw a progress indicator on the bottom of pixmap with height pixels"""
-    if not hasattr(plex_item, 'in_progress'):
-        return
-    if not plex_item.in_progress:
-        return
     progress_color = QtGui.QColor(204, 123, 25)
-    progress = plex_item.view_offset / max(1, plex_item.duration)
     p = QtGui.QPainter(pixmap)
     rect = p.window()
     progress_rect = QtCore.QRect(rect.bottomLeft() - QtCore.QPoint(0, height),
@@ -80,12 +136,8 @@ def draw_progress_bar(plex_item, pixmap, height=6):
     p.fillRect(progress_fill, QtGui.QBrush(progress_color))
 
 
-def draw_unwatched_indicator(plex_item, pixmap, size=0.20):
+def draw_unwatched_indicator(pixmap, size=0.20):
     """draw a triangle on the top right of pixmap"""
-    if not hasattr(plex_item, 'watched') and not hasattr(plex_item, 'in_progress'):
-        return
-    if plex_item.watched or plex_item.in_progress:
-        return
     p = QtGui.QPainter(pixmap)
     rect = p.window()
     top_right = rect.topRight()
@@ -100,31 +152,56 @@ def draw_unwatched_indicator(plex_item, pixmap, size=0.20):
     p.drawPolygon(triangle)
 
 
+# wrapped text by (text, font, width, max lines), see elide_text
+TEXT_LAYOUT_CACHE_SIZE = 1024
+_text_layouts = collections.OrderedDict()
+
+
 def elide_text(painter, rect, string):
     """paint `string` with `painter` inside `rect`"""
+    font = painter.font()
+    line_spacing = painter.fontMetrics().lineSpacing()
+    max_lines = max(1, rect.height() // line_spacing)
+    key = (string, font.key(), rect.width(), max_lines)
+    try:
+        _text_layouts.move_to_end(key)
+        lines = _text_layouts[key]
+    except KeyError:
+        lines = _layout_text(painter, string, rect.width(), max_lines)
+        _text_layouts[key] = lines
+        if len(_text_layouts) > TEXT_LAYOUT_CACHE_SIZE:
+            _text_layouts.popitem(last=False)
+    for i, line in enumerate(lines):
+        painter.drawStaticText(rect.left(), rect.top() + i * line_spacing, line)
+
+
+def _layout_text(painter, string, width, max_lines):
+    """wrap `string` to `width`, eliding the last of `max_lines` lines, and
+    return the lines as prepared QStaticTexts"""
+    font = painter.font()
     font_metrics = painter.fontMetrics()
-    line_spacing = font_metrics.lineSpacing()
-    y = 0
-    text_layout = QtGui.QTextLayout(string, painter.font())
+    text_layout = QtGui.QTextLayout(string, font)
     text_layout.beginLayout()
-    while True:
+    lines = []
+    while len(lines) < max_lines:
         line = text_layout.createLine()
         if not line.isValid():
             break
-        line.setLineWidth(rect.width())
-        next_line_y = y + line_spacing
-        if rect.height() >= next_line_y + line_spacing:
-            line.draw(painter, QtCore.QPoint(rect.left(), rect.top() + y))
-            y = next_line_y
+        line.setLineWidth(width)
+        if len(lines) < max_lines - 1:
+            text = string[line.textStart():line.textStart() + line.textLength()]
         else:
-            last_line = string[line.textStart():]
-            elided_last_line = font_metrics.elidedText(
-                last_line, QtCore.Qt.ElideRight, rect.width())
-            painter.drawText(QtCore.QPoint(rect.left(),
-                             rect.top() + y + font_metrics.ascent()),
-                             elided_last_line)
-            line = text_layout.createLine()
-            break
+            text = font_metrics.elidedText(string[line.textStart():],
+                                           QtCore.Qt.ElideRight, width)
+        lines.append(text)
+    text_layout.endLayout()
+    static_lines = []
+    for text in lines:
+        static_text = QtGui.QStaticText(text.replace('\n', ' '))
+        static_text.setTextFormat(QtCore.Qt.PlainText)
+        static_text.prepare(painter.transform(), font)
+        static_lines.append(static_text)
+    return static_lines
 
 
 # class TileDelegate(BaseDelegate):
@@ -287,20 +364,32 @@ def elide_text(painter, rect, string):
 
 class ListDelegate(BaseDelegate):
 
+    def scale_thumb(self, thumb, icon_size):
+        if thumb.width() > thumb.height():
+            scaled = thumb.scaledToHeight(
+                icon_size.height(), QtCore.Qt.SmoothTransformation)
+            return scaled.copy(scaled.width() / 2 - icon_size.height() / 2, 0,
+                               icon_size.height(), icon_size.height())
+        elif thumb.width() < thumb.height():
+            scaled = thumb.scaledToWidth(
+                icon_size.height(), QtCore.Qt.SmoothTransformation)
+            return scaled.copy(0, scaled.height() / 2 - icon_size.height() / 2,
+                               icon_size.height(), icon_size.height())
+        else:
+            return thumb.scaledToHeight(
+                icon_size.height(), QtCore.Qt.SmoothTransformation)
+
     def paint(self, painter, option, index):
+        row = index.data(role=ROW_ROLE)
+        if row is None:
+            # its page hasn't been fetched yet
+            return
+
         self.initStyleOption(option, index)
-        item = index.data(role=QtCore.Qt.UserRole)
 
         icon_size = self.parent().iconSize()
         thumb_rect = QtCore.QRect(option.rect.topLeft(), icon_size)
 
-        if item.__class__.__name__ == 'HubsItem':
-            title_text = hub_title(item)
-        elif isinstance(item, plexdevices.hubs.Hub):
-            title_text = item.title.upper()
-        else:
-            title_text = title(item)
-
         # Background
         if option.state & QtWidgets.QStyle.State_Selected:
             painter.fillRect(option.rect, option.palette.highlight())
@@ -315,33 +404,17 @@ class ListDelegate(BaseDelegate):
         # Icon
         thumb = index.data(role=QtCore.Qt.DecorationRole)
         if thumb and not thumb.isNull():
-            if thumb.width() > thumb.height():
-                scaled = thumb.scaledToHeight(
-                    icon_size.height(), QtCore.Qt.SmoothTransformation)
-                scaled = scaled.copy(scaled.width() / 2 - icon_size.height() / 2, 0,
-                                     icon_size.height(), icon_size.height())
-            elif thumb.width() < thumb.height():
-                scaled = thumb.scaledToWidth(
-                    icon_size.height(), QtCore.Qt.SmoothTransformation)
-                scaled = scaled.copy(0, scaled.height() / 2 - icon_size.height() / 2,
-                                     icon_size.height(), icon_size.height())
-            else:
-                scaled = thumb.scaledToHeight(
-                    icon_size.height(), QtCore.Qt.SmoothTransformation)
-            if item.markable:
-                draw_progress_bar(item, scaled, height=6)
-                draw_unwatched_indicator(item, scaled, size=0.20)
             QtWidgets.QApplication.style().drawItemPixmap(
                 painter, option.rect,
                 QtCore.Qt.AlignLeft | QtCore.Qt.AlignVCenter,
-                scaled)
+                self.scaled_thumb(row, thumb, icon_size))
 
         text_rect = QtCore.QRect(option.rect.topLeft(), option.rect.bottomRight())
         text_rect.setLeft(thumb_rect.right() + 4)
 
         # Right Title
-        if hasattr(item, 'duration'):
-            line_text = timestamp_from_ms(item.duration, minimal=True)
+        if row.duration:
+            line_text = row.duration
             painter.save()
             if painter.pen().color().value() < 128:
                 painter.setPen(QtGui.QPen(painter.pen().color().lighter()))
@@ -364,7 +437,7 @@ class ListDelegate(BaseDelegate):
         painter.setFont(self.title_font)
 
         elided_text = painter.fontMetrics().elidedText(
-            title_text, QtCore.Qt.ElideRight, text_rect.width())
+            row.title, QtCore.Qt.ElideRight, text_rect.width())
         painter.drawText(text_rect, QtCore.Qt.AlignLeft, elided_text)
 
         text_rect.setRight(option.rect.right())
@@ -373,11 +446,11 @@ class ListDelegate(BaseDelegate):
         painter.restore()
 
         # Summary text. wrap and elide
-        if hasattr(item, 'summary'):
+        if row.summary:
             painter.save()
             painter.setFont(self.summary_font)
-            summary_text = item.summary
-            if not summary_text or text_rect.height() < painter.fontMetrics().height():
+            summary_text = row.summary
+            if text_rect.height() < painter.fontMetrics().height():
                 painter.restore()
                 return
             if painter.pen().color().value() < 128:
@@ -390,50 +463,33 @@ class ListDelegate(BaseDelegate):
         self.last_icon_size = self.parent().iconSize().height()
 
     def sizeHint(self, option, index):
-        if isinstance(index.data(role=QtCore.Qt.UserRole), plexdevices.hubs.Hub):
+        row = index.data(role=ROW_ROLE)
+        if row is not None and row.is_hub:
             return super().sizeHint(option, index)
         return QtCore.QSize(0, self.parent().iconSize().height())
 
 
 class TileDelegateUniform(BaseDelegate):
 
-    def summary_line_count(self, item):
-        if isinstance(item, plexdevices.media.Episode):
-            return 2
-        elif isinstance(item, plexdevices.media.Album):
-            return 1
-        elif isinstance(item, plexdevices.media.Movie):
-            return 1
-        elif isinstance(item, plexdevices.media.Track):
-            return 1
+    def scale_thumb(self, thumb, icon_size):
+        if thumb.height() > thumb.width():
+            scaled = thumb.scaledToWidth(icon_size.height(),
+                                         QtCore.Qt.SmoothTransformation)
+            return scaled.copy(0, scaled.height() / 2 - icon_size.height() / 2,
+                               icon_size.height(), icon_size.height())
         else:
-            return 0
+            return thumb.scaledToHeight(icon_size.height(),
+                                        QtCore.Qt.SmoothTransformation)
 
     def paint(self, painter, option, index):
-        item = index.data(role=QtCore.Qt.UserRole)
-        if not item:
+        row = index.data(role=ROW_ROLE)
+        if row is None:
             return
 
         self.initStyleOption(option, index)
 
         icon_size = self.parent().iconSize()
-
-        lines = []
-        if isinstance(item, plexdevices.media.Episode):
-            lines.append(item.grandparent_title)
-            lines.append(item.title)
-            lines.append('S{} E{}'.format(item.parent_index, item.index))
-        elif isinstance(item, plexdevices.media.Album):
-            lines.append(item.parent_title)
-            lines.append(item.title)
-        elif isinstance(item, plexdevices.media.Movie):
-            lines.append(item.title)
-            lines.append(str(item.year))
-        elif isinstance(item, plexdevices.media.Track):
-            lines.append(item.title)
-            lines.append(timestamp_from_ms(item.duration, minimal=True))
-        else:
-            lines.append(item.title)
+        lines = row.lines
 
         icon_rect = QtCore.QRect(
             option.rect.topLeft(),
@@ -464,22 +520,9 @@ class TileDelegateUniform(BaseDelegate):
         # Icon
         thumb = index.data(role=QtCore.Qt.DecorationRole)
         if thumb and not thumb.isNull():
-            if thumb.height() > thumb.width():
-                scaled = thumb.scaledToWidth(icon_size.height(),
-                                             QtCore.Qt.SmoothTransformation)
-                scaled = scaled.copy(0, scaled.height() / 2 - icon_size.height() / 2,
-                                     icon_size.height(), icon_size.height())
-            elif thumb.height() < thumb.width():
-                scaled = thumb.scaledToHeight(icon_size.height(),
-                                              QtCore.Qt.SmoothTransformation)
-            else:
-                scaled = thumb.scaledToHeight(
-                    icon_size.height(), QtCore.Qt.SmoothTransformation)
-            if item.markable:
-                draw_progress_bar(item, scaled, height=6)
-                draw_unwatched_indicator(item, scaled, size=0.20)
             QtWidgets.QApplication.style().drawItemPixmap(
-                painter, option.rect, QtCore.Qt.AlignTop | QtCore.Qt.AlignHCenter, scaled)
+                painter, option.rect, QtCore.Qt.AlignTop | QtCore.Qt.AlignHCenter,
+                self.scaled_thumb(row, thumb, icon_size))
 
         # Title
         painter.save()
@@ -511,8 +554,8 @@ class TileDelegateUniform(BaseDelegate):
 
     def sizeHint(self, option, index):
         icon_size = self.parent().iconSize()
-        item = index.data(role=QtCore.Qt.UserRole)
-        summary_lines = self.summary_line_count(item)
+        row = index.data(role=ROW_ROLE)
+        summary_lines = 0 if row is None else row.summary_lines
         text_height = (self.title_font_metrics.height() +
                        self.summary_font_metrics.height() * summary_lines)
         return QtCore.QSize(icon_size.width(), icon_size.height() + text_height)
\ No newline at end of file
@@ -0,0 +1,318 @@
+# plexdesktop
+# Copyright (c) 2016 Cory Parsons <parsons.cory@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import json
+import math
+import time
+import logging
+import threading
+import urllib.parse
+
+from plexdesktop.settings import Settings
+
+logger = logging.getLogger('plexdesktop')
+
+PART_SUFFIX = '.part'
+MANIFEST_SUFFIX = '.part.json'
+
+
+def merge_ranges(ranges):
+    """Sort and join overlapping or touching (first, last) byte ranges."""
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def strip_token(url):
+    """`url` without its query string, so no token ends up on disk."""
+    return urllib.parse.urlsplit(url)._replace(query='').geturl()
+
+
+def describe_error(error):
+    """`error` for the downloads window, without the token of any url in
+    it."""
+    return re.sub(r'(X-Plex-Token=)[^&\s]+', r'\1...', str(error)) or error.__class__.__name__
+
+
+class Manifest(object):
+    """The sidecar of a ``.part`` file. Records where the file comes from and
+    which byte ranges of it are already on disk, so an interrupted download
+    can carry on with range requests instead of starting over.
+    """
+
+    def __init__(self, path, url='', size=None, etag=None, ranges=None):
+        self.path = path
+        self.url = url
+        self.size = size
+        self.etag = etag
+        self.ranges = merge_ranges(ranges or [])
+
+    @property
+    def part_path(self):
+        return self.path + PART_SUFFIX
+
+    @property
+    def manifest_path(self):
+        return self.path + MANIFEST_SUFFIX
+
+    @classmethod
+    def load(cls, path):
+        """The manifest of the download to `path`, or None if there isn't a
+        usable one."""
+        try:
+            with open(path + MANIFEST_SUFFIX, 'r') as f:
+                data = json.load(f)
+            return cls(path, data['url'], data['size'], data['etag'],
+                       [tuple(r) for r in data['ranges']])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error('Manifest: {}: {}'.format(path, e))
+            return None
+
+    def save(self):
+        """Write the manifest next to the part file. It's replaced in one
+        step so a crash never leaves half of one behind."""
+        tmp = self.manifest_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'url': self.url, 'size': self.size, 'etag': self.etag,
+                       'ranges': self.ranges}, f)
+        os.replace(tmp, self.manifest_path)
+
+    def remove(self, part=False):
+        """Delete the manifest, and the part file too if `part`."""
+        for path in ((self.manifest_path, self.part_path) if part else
+                     (self.manifest_path,)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def matches(self, url, size, etag):
+        """True if the part file on disk is of the same remote file."""
+        return (self.url == strip_token(url) and self.size == size and
+                self.etag == etag and os.path.exists(self.part_path) and
+                os.path.getsize(self.part_path) == size)
+
+    def add(self, first, last):
+        self.ranges = merge_ranges(self.ranges + [(first, last)])
+
+    @property
+    def completed(self):
+        """bytes on disk"""
+        return sum(last - first + 1 for first, last in self.ranges)
+
+    def missing(self):
+        """The (first, last) byte ranges still to fetch."""
+        gaps, pos = [], 0
+        for first, last in self.ranges:
+            if first > pos:
+                gaps.append((pos, first - 1))
+            pos = max(pos, last + 1)
+        if self.size is not None and pos < self.size:
+            gaps.append((pos, self.size - 1))
+        return gaps
+
+
+class TokenBucket(object):
+    """Limits the bytes per second that go through it, shared by threads.
+
+    `rate` is in bytes per second, 0 for no limit. Up to a second of unused
+    rate can be spent at once. A consumer that takes more than is there
+    leaves the bucket in debt and sleeps until it's paid back, so large
+    blocks don't need special handling.
+    """
+
+    def __init__(self, rate=0):
+        self.rate = rate
+        self._tokens = rate
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self.rate = rate
+            self._tokens = min(self._tokens, rate)
+
+    def consume(self, size):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            self._tokens -= size
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class Progress(object):
+    """How far one download is. Written by the threads downloading it and
+    read by the window, without a lock: `counters` has one slot per
+    connection, each with a single writer, and the window only ever reads a
+    value a moment out of date.
+
+    The rate and ETA are worked out on the reading side by
+    :class:`ProgressBoard`.
+    """
+
+    __slots__ = ('size', 'base', 'counters', 'rate', '_last', '_stamp',
+                 '_counters')
+
+    def __init__(self):
+        self.size = None
+        self.base = 0  # bytes already on disk when it (re)started
+        self.counters = ()  # bytes written by each connection since then
+        self.rate = 0.0
+        self._last = None
+        self._stamp = None
+        self._counters = None
+
+    def start(self, size, base, counters):
+        """Called by the worker as it starts transferring."""
+        self.counters = ()
+        self.size = size
+        self.base = base
+        self.counters = counters
+
+    @property
+    def done(self):
+        return self.base + sum(self.counters)
+
+    @property
+    def percent(self):
+        return int(self.done * 100.0 / self.size) if self.size else 0
+
+    @property
+    def eta(self):
+        """seconds left at the current rate, None if it can't be told"""
+        if not self.size or self.rate < 1:
+            return None
+        return max(0, self.size - self.done) / self.rate
+
+
+class ProgressBoard(object):
+    """The :class:`Progress` of every download, sampled together at the UI
+    refresh rate. Rates are exponentially weighted moving averages with a
+    time constant of `TAU` seconds, so they follow stalls and speed-ups
+    instead of averaging over the whole download.
+    """
+    TAU = 3.0
+
+    def __init__(self):
+        self.entries = {}
+        self.rate = 0.0  # of every download together
+
+    def add(self, key, progress):
+        self.entries[key] = progress
+
+    def remove(self, key):
+        self.entries.pop(key, None)
+
+    def sample(self, now=None):
+        """Update every rate, and return the total."""
+        now = time.monotonic() if now is None else now
+        total = 0.0
+        for progress in self.entries.values():
+            counters = progress.counters
+            done = progress.base + sum(counters)
+            if progress._counters is not counters:
+                # first sample since it (re)started: nothing to compare with
+                progress._last, progress._stamp = done, now
+                progress._counters = counters
+                total += progress.rate
+                continue
+            dt = now - progress._stamp
+            if dt <= 0:
+                total += progress.rate
+                continue
+            rate = (done - progress._last) / dt
+            if progress.rate:
+                progress.rate += (1 - math.exp(-dt / self.TAU)) * (rate - progress.rate)
+            else:  # the first measurement, don't climb up from zero
+                progress.rate = rate
+            progress._last, progress._stamp = done, now
+            total += progress.rate
+        self.rate = total
+        return total
+
+
+class Batch(object):
+    """Files queued together, e.g. every episode of a show. The window shows
+    them as one entry."""
+
+    def __init__(self, title, files, size, skipped=0):
+        self.title = title
+        self.files = files  # how many were queued
+        self.size = size  # bytes of the queued files, None if not known
+        self.skipped = skipped  # files that were already downloaded
+        self.jobs = []  # the ones that haven't finished
+        self.finished = 0
+        self.failed = 0
+        self._finished_bytes = 0
+
+    def finish(self, job, ok):
+        self.jobs.remove(job)
+        if ok:
+            self.finished += 1
+            self._finished_bytes += job.progress.size or 0
+        else:
+            self.failed += 1
+
+    @property
+    def done(self):
+        return self._finished_bytes + sum(job.progress.done for job in self.jobs)
+
+    @property
+    def rate(self):
+        return sum(job.progress.rate for job in self.jobs)
+
+    @property
+    def percent(self):
+        return int(self.done * 100.0 / self.size) if self.size else 0
+
+    @property
+    def eta(self):
+        rate = self.rate
+        if not self.size or rate < 1:
+            return None
+        return max(0, self.size - self.done) / rate
+
+
+def rate_limit(name):
+    """The ``download_limit_kb`` or ``download_server_limit_kb`` setting in
+    bytes per second, 0 if it's unlimited."""
+    return int(Settings().value(name, 0)) * 1024
+
+
+def pending():
+    """The downloads that haven't finished, as dicts of server, key,
+    destination and file, oldest first."""
+    try:
+        return json.loads(Settings().value('downloads', '[]'))
+    except ValueError:
+        return []
+
+
+def set_pending(downloads):
+    Settings().setValue('downloads', json.dumps(downloads))
@@ -14,7 +14,9 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import queue
+import logging
+import os
+import collections
 
 from PyQt5 import QtWidgets, QtCore, QtGui
 
@@ -22,68 +24,269 @@ import plexdesktop.components
 import plexdesktop.style
 
 import plexdesktop.settings
+import plexdesktop.sessionmanager
+import plexdesktop.downloads
+import plexdesktop.imagecache
+import plexdesktop.sqlcache
+import plexdesktop.httppool
 import plexdesktop.utils
 import plexdesktop.workers
 import plexdesktop.ui.downloadwindow_ui
 import plexdesktop.ui.login_ui
 
+logger = logging.getLogger('plexdesktop')
+
 
 class DownloadManager(plexdesktop.components.ComponentWindow):
-    download = QtCore.pyqtSignal(queue.Queue)
+    REFRESH_INTERVAL = 250  # ms
 
     def __init__(self, name, parent=None):
         super().__init__(name, parent)
         self.ui = plexdesktop.ui.downloadwindow_ui.Ui_DownloadWindow()
         self.ui.setupUi(self)
 
-        self.mutex = QtCore.QMutex()
-
         self.setWindowTitle('Downloads')
         self.setWindowFlags(QtCore.Qt.Window)
         self.spacer = QtWidgets.QSpacerItem(1, 1, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Expanding)
         self.ui.layout.insertItem(-1, self.spacer)
         self.jobs = {}
-        self.queue = queue.Queue()
+
+        self.scheduler = plexdesktop.workers.DownloadScheduler(self)
+        self.scheduler.worker.complete.connect(self.complete)
+        self.scheduler.worker.canceled.connect(self.cancel)
+        self.scheduler.started.connect(lambda job: self._arrange())
+
+        # the workers don't signal progress, it's read from here
+        self.board = plexdesktop.downloads.ProgressBoard()
+        self._refresh_timer = QtCore.QTimer(self)
+        self._refresh_timer.setInterval(self.REFRESH_INTERVAL)
+        self._refresh_timer.timeout.connect(self.refresh)
+
+        self.fetch_service = plexdesktop.components.ComponentManager.Instance().fetch_service
+        self.restorer = plexdesktop.workers.DownloadRestorer()
+        self.restorer.item_ready.connect(self.add)
+        self.expander = plexdesktop.workers.BatchExpander()
+        self.expander.expanded.connect(self._add_batch)
+        QtCore.QTimer.singleShot(0, self.restore)
 
     def toggle_visible(self):
         self.setVisible(not self.isVisible())
 
-    def add(self, item, destination):
-        job = plexdesktop.workers.DownloadJob(self.mutex, item, destination)
-        job.worker.progress.connect(self.progress)
-        self.download.connect(job.worker.download_file)
-        job.worker.complete.connect(self.complete)
-        job.worker.canceled.connect(self.cancel)
-
-        self.queue.put(job)
+    def restore(self):
+        """pick up the downloads that didn't finish last time"""
+        downloads = plexdesktop.downloads.pending()
+        if not downloads:
+            return
+        session_manager = plexdesktop.sessionmanager.SessionManager()
+        session_manager.load_session()
+        if not session_manager.session.servers:
+            return
+        for download in downloads:
+            server = session_manager.session.get_server_by_id(download['server'])
+            if server is None:
+                logger.error('DownloadManager: no server for {}'.format(download['file']))
+                continue
+            self.fetch_service.submit(self, self.restorer.run, server,
+                                      download['key'], download['destination'])
+
+    def _remember(self, items, destination):
+        downloads = plexdesktop.downloads.pending()
+        known = {os.path.join(d['destination'], d['file']) for d in downloads}
+        for item in items:
+            file_name = item.media[0].parts[0].file_name
+            if os.path.join(destination, file_name) in known:
+                continue
+            downloads.append({'server': item.container.server.client_identifier,
+                              'key': item.key, 'destination': destination,
+                              'file': file_name})
+        plexdesktop.downloads.set_pending(downloads)
+
+    def _forget(self, job):
+        path = self._path(job.item, job.destination)
+        plexdesktop.downloads.set_pending(
+            [d for d in plexdesktop.downloads.pending()
+             if os.path.join(d['destination'], d['file']) != path])
+
+    @staticmethod
+    def _path(item, destination):
+        return os.path.join(destination, item.media[0].parts[0].file_name)
+
+    def _queued(self):
+        """the paths of every file being downloaded"""
+        return {self._path(job.item, job.destination) for job, _ in self.jobs.values()}
+
+    def add(self, item, destination, priority=0):
+        if self._path(item, destination) in self._queued():
+            return
+        self._remember([item], destination)
         dialog = FileDownload("Downloading. {}".format(plexdesktop.utils.title(item)), "Cancel",
                               0, 100, title=item.title)
-        self.jobs[job.id] = (job, dialog)
-        dialog.canceled.connect(job.cancel)
+        job = self._add_job(item, destination, priority, dialog)
+        dialog.canceled.connect(lambda: self.scheduler.cancel(job))
         dialog.paused.connect(job.toggle_pause)
-        dialog.update_progress(job, 0, 0)
+        dialog.moved.connect(lambda offset: self.move([job], offset))
+        dialog.retried.connect(lambda: self.retry(job))
+        self._show_dialog(dialog)
+        self.scheduler.add(job)
+        self._arrange()
+
+    def add_batch(self, item, destination):
+        """Download every file under `item`, a show, season, album or artist,
+        as one entry. The files are looked up first."""
+        self.fetch_service.submit(self, self.expander.run, item, destination)
+
+    def _add_batch(self, item, items, destination, failed=0):
+        queued = self._queued()
+        files, size, skipped = [], 0, 0
+        for child in items:
+            path = self._path(child, destination)
+            if path in queued:
+                continue
+            queued.add(path)
+            part_size = child.media[0].parts[0].size
+            if (part_size is not None and os.path.exists(path) and
+                    os.path.getsize(path) == part_size):
+                skipped += 1
+                continue
+            files.append(child)
+            size = None if size is None or part_size is None else size + part_size
+        title = plexdesktop.utils.title(item)
+        if failed:
+            plexdesktop.utils.msg_box(
+                "{} folder(s) of {} couldn't be listed, their files aren't "
+                "being downloaded.".format(failed, title))
+        if not files:
+            logger.info('DownloadManager: everything in {} is already downloaded'.format(title))
+            return
+        self._remember(files, destination)
+        batch = plexdesktop.downloads.Batch(title, len(files), size, skipped)
+        dialog = BatchDownload(batch, "Downloading. {}".format(title), "Cancel", 0, 100)
+        for child in files:
+            batch.jobs.append(self._add_job(child, destination, 0, dialog))
+        dialog.canceled.connect(lambda: [self.scheduler.cancel(job) for job in list(batch.jobs)])
+        dialog.paused.connect(lambda: self.toggle_pause(batch.jobs))
+        dialog.moved.connect(lambda offset: self.move(batch.jobs, offset))
+        self._show_dialog(dialog)
+        for job in batch.jobs:
+            self.scheduler.add(job)
+        self._arrange()
+
+    def _add_job(self, item, destination, priority, dialog):
+        job = plexdesktop.workers.DownloadJob(item, destination, priority)
+        self.jobs[job.id] = (job, dialog)
+        self.board.add(job.id, job.progress)
+        return job
+
+    def _show_dialog(self, dialog):
         self.ui.layout.insertWidget(self.ui.layout.count() - 1, dialog)
-        self.download.emit(self.queue)
+        self.refresh()
+        self._refresh_timer.start()
         self.show()
 
+    def toggle_pause(self, jobs):
+        """pause all of `jobs`, or resume them if they're all paused"""
+        if all(job.paused for job in jobs):
+            for job in jobs:
+                job.resume()
+        else:
+            for job in jobs:
+                job.pause()
+
+    def move(self, jobs, offset):
+        # move the first ones first, so they keep their order
+        for job in (jobs if offset < 0 else reversed(jobs)):
+            self.scheduler.move(job, offset)
+        self._arrange()
+
+    def _rows(self):
+        """every entry of the window in the order their downloads run, with
+        its first job"""
+        rows = collections.OrderedDict()
+        for job in self.scheduler.jobs():
+            if job.id in self.jobs:
+                rows.setdefault(self.jobs[job.id][1], job)
+        return rows.items()
+
+    def _arrange(self):
+        """lay the downloads out in the order they run"""
+        for index, (dialog, _) in enumerate(self._rows()):
+            if self.ui.layout.indexOf(dialog) != index:
+                self.ui.layout.removeWidget(dialog)
+                self.ui.layout.insertWidget(index, dialog)
+
     def complete(self, job):
         job, dialog = self.jobs[job.id]
-        job.quit()
-        self.ui.layout.removeWidget(dialog)
-        dialog.close()
-        del self.jobs[job.id]
+        self._forget(job)
+        self._remove(job, dialog, True)
 
     def cancel(self, job):
-        self.complete(job)
-
-    def progress(self, job, val, rate):
         job, dialog = self.jobs[job.id]
-        dialog.update_progress(job, val, rate)
+        if job.cancelled:
+            self._forget(job)
+        elif job.error is not None and not isinstance(dialog, BatchDownload):
+            # the entry stays to say so, with a retry. batches count them
+            dialog.set_failed(job.item.title, job.error)
+            return
+        # otherwise it's tried again from where it stopped on the next start
+        self._remove(job, dialog, False)
+
+    def retry(self, job):
+        """download a file that failed again, from where it stopped"""
+        job, dialog = self.jobs[job.id]
+        job.retry()
+        dialog.set_failed(job.item.title, None)
+        self.scheduler.add(job)
+        self._arrange()
+        self._refresh_timer.start()
+
+    def _remove(self, job, dialog, ok):
+        del self.jobs[job.id]
+        self.board.remove(job.id)
+        if isinstance(dialog, BatchDownload):
+            dialog.batch.finish(job, ok)
+        if not any(d is dialog for _, d in self.jobs.values()):
+            self.ui.layout.removeWidget(dialog)
+            dialog.close()
+        if not self.jobs:
+            self._refresh_timer.stop()
+            self.refresh()
+
+    def refresh(self):
+        """show how every download is doing, and how fast they all go"""
+        rate = self.board.sample()
+        running = self.scheduler.running
+        for dialog, job in self._rows():
+            if isinstance(dialog, BatchDownload):
+                dialog.update_progress(running)
+            else:
+                dialog.update_progress(job, job in running)
+        if running:
+            self.setWindowTitle('Downloads - {} running, {}'.format(
+                len(running), format_rate(rate)))
+        else:
+            self.setWindowTitle('Downloads')
+
+
+def format_size(size):
+    """`size` in bytes, for people"""
+    for unit, scale in (('GB', 1024 ** 3), ('MB', 1024 ** 2)):
+        if size >= scale:
+            return '{:,.1f} {}'.format(size / scale, unit)
+    return '{:,.1f} KB'.format(size / 1024)
+
+
+def format_rate(rate):
+    """`rate` in bytes per second, for people"""
+    if rate >= 1024 * 1024:
+        return '{:,.1f} MB/s'.format(rate / (1024 * 1024))
+    return '{:,.1f} KB/s'.format(rate / 1024)
 
 
 class FileDownload(QtWidgets.QProgressDialog):
     update = QtCore.pyqtSignal(float)
     paused = QtCore.pyqtSignal()
+    moved = QtCore.pyqtSignal(int)
+    retried = QtCore.pyqtSignal()
 
     def __init__(self, *args, title='file', parent=None, **kwargs):
         super().__init__(*args, parent=parent, **kwargs)
@@ -97,10 +300,71 @@ class FileDownload(QtWidgets.QProgressDialog):
         self.setSizePolicy(QtWidgets.QSizePolicy.Preferred, QtWidgets.QSizePolicy.Minimum)
         self.setMaximumHeight(100)
         self.setMinimumHeight(100)
+        self.failed = False
 
-    def update_progress(self, job, val, rate):
-        self.update.emit(val)
-        self.label.setText('{} {:,.1f} kbps'.format(job.item.title, rate / 1024))
+    def contextMenuEvent(self, event):
+        menu = QtWidgets.QMenu(self)
+        if self.failed:
+            menu.addAction('Retry').triggered.connect(lambda: self.retried.emit())
+        else:
+            for text, offset in (('Move to top', -1000), ('Move up', -1),
+                                 ('Move down', 1), ('Move to bottom', 1000)):
+                menu.addAction(text).setData(offset)
+            menu.triggered.connect(lambda action: self.moved.emit(action.data()))
+        menu.exec_(event.globalPos())
+
+    def set_failed(self, title, error):
+        """show that the download failed with `error`, or that it's being
+        tried again if it's None"""
+        self.failed = error is not None
+        if self.failed:
+            self.label.setText('{} failed: {} (right-click to retry)'.format(title, error))
+        else:
+            self.label.setText('{} waiting'.format(title))
+
+    def update_progress(self, job, running):
+        progress = job.progress
+        self.setValue(progress.percent)
+        if job.paused:
+            status = 'paused'
+        elif not running:
+            status = 'waiting'
+        elif progress.eta is None:
+            status = format_rate(progress.rate)
+        else:
+            status = '{}, {} left'.format(
+                format_rate(progress.rate),
+                plexdesktop.utils.timestamp_from_ms(progress.eta * 1000))
+        self.label.setText('{} {}'.format(job.item.title, status))
+
+
+class BatchDownload(FileDownload):
+    """One entry for all the files of a :class:`plexdesktop.downloads.Batch`."""
+
+    def __init__(self, batch, *args, parent=None, **kwargs):
+        super().__init__(*args, title=batch.title, parent=parent, **kwargs)
+        self.batch = batch
+
+    def update_progress(self, running):
+        batch = self.batch
+        self.setValue(batch.percent)
+        status = '{} of {} files'.format(batch.finished, batch.files)
+        if batch.size:
+            status += ', {} of {}'.format(format_size(batch.done), format_size(batch.size))
+        if batch.jobs and all(job.paused for job in batch.jobs):
+            status += ', paused'
+        elif any(job in running for job in batch.jobs):
+            status += ', ' + format_rate(batch.rate)
+            if batch.eta is not None:
+                status += ', {} left'.format(
+                    plexdesktop.utils.timestamp_from_ms(batch.eta * 1000))
+        else:
+            status += ', waiting'
+        if batch.skipped:
+            status += ' ({} already downloaded)'.format(batch.skipped)
+        if batch.failed:
+            status += ' ({} failed)'.format(batch.failed)
+        self.label.setText('{}: {}'.format(batch.title, status))
 
 
 class HubSearch(QtWidgets.QLineEdit):
@@ -307,10 +571,106 @@ class SettingsDialog(QtWidgets.QDialog):
         icon_size.setValidator(QtGui.QIntValidator(0, 300))
         self.form.addRow(QtWidgets.QLabel('thumbnail size'), icon_size)
 
+        thumb_workers = QtWidgets.QSpinBox()
+        thumb_workers.setRange(1, 16)
+        thumb_workers.setValue(int(s.value('thumb_workers', 4)))
+        self.form.addRow(QtWidgets.QLabel('thumbnail downloads'), thumb_workers)
+
+        http_pool_size = QtWidgets.QSpinBox()
+        http_pool_size.setRange(1, 64)
+        http_pool_size.setValue(plexdesktop.httppool.pool_size())
+        self.form.addRow(QtWidgets.QLabel('connections per server'), http_pool_size)
+
+        download_segments = QtWidgets.QSpinBox()
+        download_segments.setRange(1, 16)
+        download_segments.setValue(int(s.value('download_segments', 4)))
+        self.form.addRow(QtWidgets.QLabel('connections per download'), download_segments)
+
+        download_concurrent = QtWidgets.QSpinBox()
+        download_concurrent.setRange(1, 16)
+        download_concurrent.setValue(int(s.value('download_concurrent', 2)))
+        self.form.addRow(QtWidgets.QLabel('downloads at once'), download_concurrent)
+
+        download_per_server = QtWidgets.QSpinBox()
+        download_per_server.setRange(1, 16)
+        download_per_server.setValue(int(s.value('download_per_server', 2)))
+        self.form.addRow(QtWidgets.QLabel('downloads per server'), download_per_server)
+
+        download_sync = QtWidgets.QSpinBox()
+        download_sync.setRange(0, 600)
+        download_sync.setSuffix(' s')
+        download_sync.setSpecialValueText('never')
+        download_sync.setValue(int(s.value('download_sync_interval', 5)))
+        self.form.addRow(QtWidgets.QLabel('sync downloads to disk every'), download_sync)
+
+        download_limits = {}
+        for name, label in (('download_limit_kb', 'download limit'),
+                            ('download_server_limit_kb', 'download limit per server')):
+            limit = QtWidgets.QSpinBox()
+            limit.setRange(0, 1024 * 1024)
+            limit.setSuffix(' KB/s')
+            limit.setSpecialValueText('unlimited')
+            limit.setValue(int(s.value(name, 0)))
+            self.form.addRow(QtWidgets.QLabel(label), limit)
+            download_limits[name] = limit
+
+        cache_limits = {}
+        cache_stats = plexdesktop.sqlcache.stats()
+        for name, (_, default_mb) in sorted(plexdesktop.sqlcache.CACHES.items()):
+            limit = QtWidgets.QSpinBox()
+            limit.setRange(16, 1024 * 1024)
+            limit.setSuffix(' MB')
+            limit.setValue(int(s.value('cache_{}_mb'.format(name), default_mb)))
+            self.form.addRow(QtWidgets.QLabel('{} cache size'.format(name)), limit)
+            hits, misses, volume, count, size_limit = cache_stats[name]
+            self.form.addRow(QtWidgets.QLabel(''), QtWidgets.QLabel(
+                '{:,} items, {:,.1f} MB. {:,} hits, {:,} misses'.format(
+                    count, volume / plexdesktop.sqlcache.MB, hits, misses)))
+            cache_limits[name] = limit
+
+        memory_limit = QtWidgets.QSpinBox()
+        memory_limit.setRange(8, 4096)
+        memory_limit.setSuffix(' MB')
+        memory_limit.setValue(int(s.value('cache_memory_mb', 64)))
+        self.form.addRow(QtWidgets.QLabel('memory thumb cache size'), memory_limit)
+        hits, misses, volume, count, size_limit = plexdesktop.imagecache.thumbs().stats()
+        self.form.addRow(QtWidgets.QLabel(''), QtWidgets.QLabel(
+            '{:,} items, {:,.1f} / {:,.0f} MB. {:.0%} hit rate'.format(
+                count, volume / plexdesktop.imagecache.MB,
+                size_limit / plexdesktop.imagecache.MB,
+                hits / max(1, hits + misses))))
+
+        eviction = QtWidgets.QComboBox()
+        eviction.addItems(plexdesktop.sqlcache.EVICTION_POLICIES)
+        eviction.setCurrentIndex(max(0, eviction.findText(
+            s.value('cache_eviction', plexdesktop.sqlcache.EVICTION_POLICIES[0]))))
+        self.form.addRow(QtWidgets.QLabel('cache eviction'), eviction)
+
+        cache_ttl = QtWidgets.QSpinBox()
+        cache_ttl.setRange(0, 3650)
+        cache_ttl.setSuffix(' days')
+        cache_ttl.setSpecialValueText('forever')
+        cache_ttl.setValue(int(float(s.value('cache_ttl_days', 30))))
+        self.form.addRow(QtWidgets.QLabel('keep cached images'), cache_ttl)
+
         widget_player = QtWidgets.QCheckBox()
         widget_player.setCheckState(QtCore.Qt.Checked if bool(int(s.value('widget_player', 0))) else QtCore.Qt.Unchecked)
         self.form.addRow(QtWidgets.QLabel('use widget player'), widget_player)
 
+        stream_containers = QtWidgets.QCheckBox()
+        stream_containers.setCheckState(QtCore.Qt.Checked if bool(int(s.value('stream_containers', 1))) else QtCore.Qt.Unchecked)
+        self.form.addRow(QtWidgets.QLabel('show items as they load'), stream_containers)
+
+        prefetch = QtWidgets.QCheckBox()
+        prefetch.setCheckState(QtCore.Qt.Checked if bool(int(s.value('prefetch', 0))) else QtCore.Qt.Unchecked)
+        self.form.addRow(QtWidgets.QLabel('prefetch while idle'), prefetch)
+
+        prefetch_budget = QtWidgets.QSpinBox()
+        prefetch_budget.setRange(1, 200)
+        prefetch_budget.setSuffix(' requests')
+        prefetch_budget.setValue(int(s.value('prefetch_budget', 20)))
+        self.form.addRow(QtWidgets.QLabel('prefetch at most'), prefetch_budget)
+
         self.buttons = QtWidgets.QDialogButtonBox(
             QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel,
             QtCore.Qt.Horizontal, self)
@@ -328,4 +688,36 @@ class SettingsDialog(QtWidgets.QDialog):
 
             s.setValue('thumb_size', int(icon_size.text()))
 
+            s.setValue('thumb_workers', thumb_workers.value())
+            plexdesktop.workers.ThumbPool.Instance().set_max_workers(
+                thumb_workers.value())
+
+            s.setValue('download_segments', download_segments.value())
+            s.setValue('download_concurrent', download_concurrent.value())
+            s.setValue('download_per_server', download_per_server.value())
+            s.setValue('download_sync_interval', download_sync.value())
+            for name, limit in download_limits.items():
+                s.setValue(name, limit.value())
+            download_manager = plexdesktop.components.ComponentManager.Instance().get(
+                'download_manager')
+            if download_manager is not None:
+                download_manager.scheduler.configure()
+
+            if http_pool_size.value() != plexdesktop.httppool.pool_size():
+                s.setValue('http_pool_size', http_pool_size.value())
+                plexdesktop.httppool.reset()
+
+            for name, limit in cache_limits.items():
+                s.setValue('cache_{}_mb'.format(name), limit.value())
+            s.setValue('cache_memory_mb', memory_limit.value())
+            plexdesktop.imagecache.thumbs().set_limit(
+                memory_limit.value() * plexdesktop.imagecache.MB)
+            s.setValue('cache_eviction', eviction.currentText())
+            s.setValue('cache_ttl_days', cache_ttl.value())
+            plexdesktop.sqlcache.configure()
+            plexdesktop.workers.CacheMaintenance.Instance().trim_all()
+
             s.setValue('widget_player', 1 if widget_player.checkState() == QtCore.Qt.Checked else 0)
+            s.setValue('stream_containers', 1 if stream_containers.checkState() == QtCore.Qt.Checked else 0)
+            s.setValue('prefetch', 1 if prefetch.checkState() == QtCore.Qt.Checked else 0)
+            s.setValue('prefetch_budget', prefetch_budget.value())
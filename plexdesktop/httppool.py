@@ -0,0 +1,160 @@
+# plexdesktop
+# Copyright (c) 2016 Cory Parsons <parsons.cory@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import xml.etree.ElementTree as ET
+
+import requests
+import plexdevices
+
+from plexdesktop.settings import Settings
+
+# server client identifier, or None for other hosts: requests.Session
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def pool_size():
+    """Connections kept open per host."""
+    return int(Settings().value('http_pool_size', 8))
+
+
+def session(server=None):
+    """Return the shared ``requests.Session`` for `server`, or the one for
+    every other host (plex.tv, images hosted elsewhere) if it's None.
+
+    Connections are kept alive between requests, so the workers don't pay
+    for a new TCP/TLS connection each time. Sessions are shared by threads.
+    """
+    key = None if server is None else server.client_identifier
+    with _sessions_lock:
+        try:
+            return _sessions[key]
+        except KeyError:
+            s = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1 if key is not None else 4,
+                pool_maxsize=pool_size())
+            s.mount('http://', adapter)
+            s.mount('https://', adapter)
+            _sessions[key] = s
+            return s
+
+
+def reset():
+    """Close every session, the next requests open new ones. Call after
+    changing the pool size."""
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for s in sessions:
+        s.close()
+
+
+def get(server, endpoint, headers=None, timeout=5, **kwargs):
+    """GET `endpoint` from `server`'s active connection on its session."""
+    # read once, another thread sets it to None when its connection fails
+    active = server.active
+    if active is None:
+        raise requests.exceptions.ConnectionError(
+            '{}: no active connection'.format(server.name))
+    h = dict(server.headers)
+    if headers:
+        h.update(headers)
+    try:
+        res = session(server).get(active.url + endpoint, headers=h,
+                                  timeout=timeout, **kwargs)
+    except requests.exceptions.ConnectionError:
+        server.active = None  # let plexdevices find another connection
+        raise
+    res.raise_for_status()
+    return res
+
+
+def media_container(server, key, size=None, page=None, params=None, timeout=5):
+    """Like ``server.media_container`` but on the pooled session. Leaves it to
+    plexdevices while the server doesn't have an active connection yet."""
+    if server.active is None:
+        return server.media_container(key, size, page, params, timeout=timeout)
+    headers = {'Accept': 'application/json'}
+    if size is not None and page is not None:
+        headers['X-Plex-Container-Start'] = str(page * size)
+        headers['X-Plex-Container-Size'] = str(size)
+    res = get(server, key, headers=headers, params=params, timeout=timeout)
+    return plexdevices.media.MediaContainer(
+        server, plexdevices.utils.parse_response(res.text))
+
+
+def _element_data(element):
+    """An XML element as the dict plexdevices builds its objects from, like
+    ``plexdevices.utils.parse_xml``."""
+    data = dict(element.items())
+    data['_elementType'] = element.tag
+    children = list(element)
+    if children:
+        data['_children'] = [_element_data(child) for child in children]
+    return data
+
+
+def iter_media_container(server, key, size=None, page=None, params=None,
+                         chunk=200, first_chunk=None, timeout=5):
+    """Like :func:`media_container`, but parse the response as it arrives
+    instead of after the last byte. Yields ``(header, children)``: the
+    container's attributes, then the data of up to `chunk` more of its
+    children each time, so the first ones can be shown while the rest are
+    still coming. The first time it's up to `first_chunk` children, if
+    given. Each child is dropped from the parse tree once it's been
+    yielded. Always yields at least once.
+    """
+    headers = {'Accept': 'application/xml'}
+    if size is not None and page is not None:
+        headers['X-Plex-Container-Start'] = str(page * size)
+        headers['X-Plex-Container-Size'] = str(size)
+    res = get(server, key, headers=headers, params=params, timeout=timeout,
+              stream=True)
+    try:
+        if 'json' in res.headers.get('Content-Type', ''):
+            data = plexdevices.utils.parse_response(res.text)
+            yield data, data.pop('_children', [])
+            return
+        parser = ET.XMLPullParser(events=('start', 'end'))
+        root, header, children, depth = None, None, [], 0
+        limit = first_chunk or chunk
+        for block in res.iter_content(64 * 1024):
+            parser.feed(block)
+            for event, element in parser.read_events():
+                if event == 'start':
+                    depth += 1
+                    if depth == 1:
+                        root = element
+                        header = dict(element.items())
+                        header['_elementType'] = element.tag
+                    continue
+                depth -= 1
+                if depth == 1:
+                    children.append(_element_data(element))
+                    root.remove(element)
+                    if len(children) >= limit:
+                        yield header, children
+                        children, limit = [], chunk
+        parser.close()
+    except ET.ParseError as e:
+        raise requests.exceptions.RequestException('{}: {}'.format(key, e))
+    finally:
+        res.close()
+    if header is None:
+        raise requests.exceptions.RequestException('{}: empty response'.format(key))
+    yield header, children
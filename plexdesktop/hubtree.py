@@ -15,16 +15,17 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-import queue
 
 import plexdevices
 
 from PyQt5 import QtCore, QtWidgets, QtGui
 
+import plexdesktop.components
 import plexdesktop.utils
 import plexdesktop.workers
 import plexdesktop.sqlcache
 import plexdesktop.delegates
+import plexdesktop.rows
 
 logger = logging.getLogger('plexdesktop')
 
@@ -35,6 +36,8 @@ class TreeItem(object):
         self.child_items = []
         self.parent = parent
         self.plex_item = plex_item
+        self.row_record = (None if plex_item is None else
+                           plexdesktop.rows.Row(plex_item))
 
     def appendChild(self, item):
         self.child_items.append(item)
@@ -64,30 +67,29 @@ class TreeItem(object):
 
 
 class TreeModel(QtCore.QAbstractItemModel):
-    work_thumbs = QtCore.pyqtSignal(queue.Queue)
 
     def __init__(self, data, parent=None):
         super().__init__(parent)
         self.root_item = TreeItem()
+        self._tree_items = {}
         self.setupModelData(data, self.root_item)
-        self.thumb_queue = plexdesktop.utils.Queue()
-        self._thumb_thread = QtCore.QThread(self)
-        self._thumb_worker = plexdesktop.workers.QueueThumbWorker()
-        self._thumb_worker.moveToThread(self._thumb_thread)
-        self._thumb_worker.result_ready.connect(self._update_thumb, QtCore.Qt.QueuedConnection)
-        self.work_thumbs.connect(self._thumb_worker.process, QtCore.Qt.QueuedConnection)
-        self._thumb_thread.start()
-        self.work_thumbs.emit(self.thumb_queue)
+        self._thumb_worker = plexdesktop.workers.QueueThumbWorker(self)
+        self._thumb_worker.result_ready.connect(self._update_thumb)
+        # tree items with new thumbs, repainted together once per event loop
+        self._changed_thumbs = set()
+        self._thumb_timer = QtCore.QTimer(self)
+        self._thumb_timer.setSingleShot(True)
+        self._thumb_timer.setInterval(0)
+        self._thumb_timer.timeout.connect(self._emit_thumbs_changed)
 
     def quit(self):
-        self.thumb_queue.clear()
-        self.thumb_queue.put(None)
-        self._thumb_thread.quit()
-        self._thumb_thread.wait()
+        self._thumb_worker.quit()
 
     def clear(self):
         self.beginResetModel()
         self.root_item = TreeItem()
+        self._tree_items.clear()
+        self._changed_thumbs.clear()
         self.endResetModel()
 
     def index(self, row, column, parent=QtCore.QModelIndex()):
@@ -130,6 +132,8 @@ class TreeModel(QtCore.QAbstractItemModel):
             return QtCore.QVariant()
         if role == QtCore.Qt.UserRole:
             return index.internalPointer().plex_item
+        elif role == plexdesktop.rows.ROW_ROLE:
+            return index.internalPointer().row_record
         elif role == QtCore.Qt.DisplayRole:
             return index.internalPointer().data(index.column())
         elif role == QtCore.Qt.DecorationRole:
@@ -140,10 +144,13 @@ class TreeModel(QtCore.QAbstractItemModel):
             if not key:
                 return plexdesktop.delegates.placeholder_thumb_generator(
                     index.internalPointer().data(index.column()))
-            img = QtGui.QPixmapCache.find(key)
+            img = self._thumb_worker.cached(item)
             if img:
                 return img
-            self.thumb_queue.put((item, index.row()))
+            if self._thumb_worker.failed(item):
+                return plexdesktop.delegates.placeholder_thumb_generator(
+                    index.internalPointer().data(index.column()))
+            self._thumb_worker.get_thumb(item, index.row())
             return QtCore.QVariant()
         else:
             return QtCore.QVariant()
@@ -164,6 +171,7 @@ class TreeModel(QtCore.QAbstractItemModel):
                     continue
                 hub = TreeItem(item, parents[-1])
                 parents[-1].appendChild(hub)
+                self._tree_items[id(item)] = hub
                 for child in item.children:
                     if child.has_reason:
                         if child.reason == 'actor':
@@ -174,9 +182,13 @@ class TreeModel(QtCore.QAbstractItemModel):
                             reason = ''
                     else:
                         reason = ''
-                    hub.appendChild(TreeItem(child, hub))
+                    tree_item = TreeItem(child, hub)
+                    hub.appendChild(tree_item)
+                    self._tree_items[id(child)] = tree_item
             else:
-                self.root_item.appendChild(TreeItem(item, self.root_item))
+                tree_item = TreeItem(item, self.root_item)
+                self.root_item.appendChild(tree_item)
+                self._tree_items[id(item)] = tree_item
 
     def setData(self, index, value, role):
         if role == QtCore.Qt.DecorationRole:
@@ -186,10 +198,25 @@ class TreeModel(QtCore.QAbstractItemModel):
             return False
 
     def _update_thumb(self, row, media_item):
-        index = self.index(row, 0)
-        if media_item != self.data(index, QtCore.Qt.UserRole) or not index.isValid():
+        # rows are relative to their hub, so look the item up instead
+        tree_item = self._tree_items.get(id(media_item))
+        if tree_item is None or tree_item.plex_item is not media_item:
             return
-        self.setData(index, None, role=QtCore.Qt.DecorationRole)
+        self._changed_thumbs.add(tree_item)
+        if not self._thumb_timer.isActive():
+            self._thumb_timer.start()
+
+    def _emit_thumbs_changed(self):
+        changed, self._changed_thumbs = self._changed_thumbs, set()
+        parents = {}
+        for tree_item in changed:
+            parents.setdefault(tree_item.parentItem(), set()).add(tree_item.row())
+        for parent, rows in parents.items():
+            for first, last in plexdesktop.utils.contiguous_ranges(rows):
+                self.dataChanged.emit(
+                    self.createIndex(first, 0, parent.child(first)),
+                    self.createIndex(last, 0, parent.child(last)),
+                    [QtCore.Qt.DecorationRole])
 
 
 class TreeView(QtWidgets.QTreeView):
@@ -211,12 +238,10 @@ class TreeView(QtWidgets.QTreeView):
         self.setIndentation(10)
         self._model = None
 
-        self._worker_thread = QtCore.QThread(self)
+        self._fetch_service = plexdesktop.components.ComponentManager.Instance().fetch_service
         self._worker = plexdesktop.workers.HubWorker()
-        self._worker.moveToThread(self._worker_thread)
         self._worker.result_ready.connect(self._add_container)
-        self.request_container.connect(self._worker.run)
-        self._worker_thread.start()
+        self.request_container.connect(self._fetch_hub)
         self.delegate = plexdesktop.delegates.ListDelegate(self)
         self.setItemDelegate(self.delegate)
         self.goto_hub.connect(self.load_hub)
@@ -224,8 +249,11 @@ class TreeView(QtWidgets.QTreeView):
     def quit(self):
         if self.model() is not None:
             self.model().quit()
-        self._worker_thread.quit()
-        self._worker_thread.wait()
+        self._fetch_service.forget(self)
+
+    def _fetch_hub(self, server, key, params):
+        self._fetch_service.submit(self, self._worker.run, server, key, params,
+                                   key='hub')
 
     def clear(self):
         if self.model():
@@ -0,0 +1,88 @@
+# plexdesktop
+# Copyright (c) 2016 Cory Parsons <parsons.cory@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import threading
+
+from plexdesktop.settings import Settings
+
+MB = 1024 * 1024
+
+
+class ImageCache(object):
+    """A thread safe LRU cache of decoded QImages, limited to `limit` bytes.
+
+    Sits in front of the disk cache so scrolling back to a thumb doesn't
+    read it from disk and decode it again once QPixmapCache dropped it.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._images = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._images)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._images.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self._images[key]
+
+    def put(self, key, image):
+        with self._lock:
+            old = self._images.pop(key, None)
+            if old is not None:
+                self.size -= old.byteCount()
+            self._images[key] = image
+            self.size += image.byteCount()
+            self._evict()
+
+    def set_limit(self, limit):
+        with self._lock:
+            self.limit = limit
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self.size = 0
+
+    def stats(self):
+        """Return (hits, misses, bytes, count, limit)"""
+        with self._lock:
+            return (self.hits, self.misses, self.size, len(self._images),
+                    self.limit)
+
+    def _evict(self):
+        while self.size > self.limit and self._images:
+            _, image = self._images.popitem(last=False)
+            self.size -= image.byteCount()
+
+
+def thumbs():
+    return THUMBS
+
+
+THUMBS = ImageCache(int(Settings().value('cache_memory_mb', 64)) * MB)
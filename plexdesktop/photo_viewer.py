@@ -50,16 +50,13 @@ class PhotoViewer(plexdesktop.components.ComponentWindow):
         self.draw_timer.setInterval(200)
         self.draw_timer.timeout.connect(self.scale_pixmap)
 
-        self.worker_thread = QtCore.QThread(self)
-        self.worker_thread.start()
+        self.fetch_service = plexdesktop.components.ComponentManager.Instance().fetch_service
         self.worker = plexdesktop.workers.ImageWorker()
         self.worker.signal.connect(self.update_img)
-        self.worker.moveToThread(self.worker_thread)
-        self.operate.connect(self.worker.run)
+        self.operate.connect(self.fetch_image)
+        self.indicator = None
         self.operate.connect(self.show_indicator)
         self.worker.signal.connect(self.hide_indicator)
-        self.worker_thread.finished.connect(self.worker_thread.deleteLater)
-        self.worker_thread.finished.connect(self.worker.deleteLater)
 
         self.rotation = 0
         self.drag_position = None
@@ -82,12 +79,17 @@ class PhotoViewer(plexdesktop.components.ComponentWindow):
         return QtCore.QSize(960, 720)
 
     def closeEvent(self, event):
-        self.worker_thread.quit()
-        self.worker_thread.wait()
+        self.fetch_service.forget(self)
         self._shutdown()
         super().closeEvent(event)
 
+    def fetch_image(self, photo_object):
+        self.fetch_service.submit(self, self.worker.run, photo_object, key='image')
+
     def show_indicator(self):
+        if self.indicator is not None:
+            # a queued image was replaced before it loaded
+            return
         self.indicator = self.scene.addText(
             'Loading', QtGui.QFont('Helvetica', 16, 1))
         self.indicator.setDefaultTextColor(QtGui.QColor('red'))
@@ -96,7 +98,9 @@ class PhotoViewer(plexdesktop.components.ComponentWindow):
         self.indicator.setPos(viwport_center - self.indicator.boundingRect().center())
 
     def hide_indicator(self):
-        self.scene.removeItem(self.indicator)
+        if self.indicator is not None:
+            self.scene.removeItem(self.indicator)
+            self.indicator = None
 
     def rotate_cw(self):
         self.ui.view.rotate(90)
@@ -0,0 +1,157 @@
+# plexdesktop
+# Copyright (c) 2016 Cory Parsons <parsons.cory@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import collections
+
+import plexdevices
+
+from PyQt5 import QtCore
+
+import plexdesktop.components
+import plexdesktop.utils
+import plexdesktop.workers
+from plexdesktop.settings import Settings
+
+logger = logging.getLogger('plexdesktop')
+
+
+class Prefetcher(QtCore.QObject):
+    """Warm the caches for where the user of a :class:`ListView` is likely to
+    go next, while they're idle: the directory they've selected, the page
+    after the ones near the viewport and On Deck, plus the first thumbs of
+    each. Containers go into the metadata index and thumbs into the thumb
+    cache, which the real fetches read before asking the server.
+
+    Off unless the ``prefetch`` setting is on. Each idle spell gets a budget
+    of ``prefetch_budget`` requests, made one at a time on the shared fetch
+    service behind every other client. Anything the user does drops what's
+    left; if that cut a round short, the wait for the next one doubles.
+    """
+    IDLE = 1500  # ms without activity before a round starts
+    MAX_IDLE = 60000
+    THUMBS = 12  # thumbs to fetch per container
+
+    def __init__(self, view):
+        super().__init__(view)
+        self.view = view
+        self.fetch_service = plexdesktop.components.ComponentManager.Instance().fetch_service
+        self.fetch_service.set_background(self)
+        self.worker = plexdesktop.workers.PrefetchWorker()
+        self.worker.container_ready.connect(self._container_ready)
+        self.worker.done.connect(self._done)
+        self.generation = 0
+        self.delay = self.IDLE
+        self.jobs = collections.deque()  # (func, args) still to submit
+        self.budget = 0
+        self.running = False
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self._start)
+
+    def quit(self):
+        self.timer.stop()
+        self._cancel()
+        self.fetch_service.set_background(self, False)
+
+    def poke(self):
+        """Called on any activity: stop, and start over once it's idle."""
+        if self.running or self.jobs:
+            self._back_off()
+        self._cancel()
+        self.timer.start(self.delay)
+
+    def _back_off(self):
+        self.delay = min(self.delay * 2, self.MAX_IDLE)
+
+    def _cancel(self):
+        self.generation += 1
+        self.worker.latest = self.generation
+        self.jobs.clear()
+        self.running = False
+        self.fetch_service.forget(self)
+
+    def _start(self):
+        if not bool(int(Settings().value('prefetch', 0))):
+            return
+        model = self.view.model()
+        if model.container is None or model.streaming:
+            return
+        if self.fetch_service.busy():
+            self._back_off()
+            self.timer.start(self.delay)
+            return
+        self.budget = int(Settings().value('prefetch_budget', 20))
+        self.jobs.extend(self._targets())
+        self._next()
+
+    def _targets(self):
+        server = self.view.current_server
+        if server is None:
+            return []
+        jobs = []
+        item = self.view.currentItem()
+        if (isinstance(item, plexdevices.media.Directory) and
+                not isinstance(item, (plexdevices.media.InputDirectory,
+                                      plexdevices.media.PreferencesDirectory)) and
+                item.container.is_library):
+            key = item.key
+            if not key.startswith('/'):  # as ListView.goto_location does
+                key = self.view.location.key + '/' + key
+            jobs.append((self.worker.container, (server, key, 100, '', {})))
+        first, last = self.view.visible_items()
+        if last >= first:
+            # request_visible_thumbs loads a screen either side already
+            edge = last + (last - first + 1)
+            model = self.view.model()
+            jobs.extend((self.worker.page, (model.container_worker, args))
+                        for args in model.next_pages(edge))
+        on_deck = plexdesktop.utils.Location.on_deck()
+        if self.view.location.key != on_deck.key:
+            jobs.append((self.worker.container,
+                         (server, on_deck.key, 100, on_deck.sort or '',
+                          on_deck.params or {})))
+        return jobs
+
+    def _next(self):
+        if self.running:
+            return
+        if not self.jobs or self.budget <= 0:
+            self.jobs.clear()
+            self.delay = self.IDLE
+            return
+        if self.fetch_service.busy():
+            self.poke()
+            return
+        func, args = self.jobs.popleft()
+        self.budget -= 1
+        self.running = True
+        self.fetch_service.submit(self, func, *(args + (self.generation,)))
+
+    @QtCore.pyqtSlot(int, plexdevices.media.MediaContainer)
+    def _container_ready(self, generation, container):
+        if generation != self.generation:
+            return
+        thumb_size = self.view.model().thumb_worker.thumb_size
+        self.jobs.extend((self.worker.thumb, (item, thumb_size)) for item in
+                         container.children[:self.THUMBS] if item.thumb)
+
+    @QtCore.pyqtSlot(int)
+    def _done(self, generation):
+        if generation != self.generation:
+            return
+        self.running = False
+        self._next()
@@ -0,0 +1,78 @@
+# plexdesktop
+# Copyright (c) 2016 Cory Parsons <parsons.cory@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import plexdevices
+
+from PyQt5 import QtCore
+
+from plexdesktop.utils import hub_title, title, timestamp_from_ms
+
+# models return a Row for this role, the plex item itself stays on UserRole
+ROW_ROLE = QtCore.Qt.UserRole + 1
+
+
+def thumb_state(plex_item):
+    """the parts of `plex_item` that are drawn on top of its thumb, or None"""
+    if not getattr(plex_item, 'markable', False):
+        return None
+    in_progress = getattr(plex_item, 'in_progress', False)
+    return (getattr(plex_item, 'watched', False), in_progress,
+            plex_item.view_offset if in_progress else 0)
+
+
+class Row(object):
+    """Everything the delegates paint for one item, worked out once when the
+    item is loaded so painting never touches the plexdevices object."""
+
+    __slots__ = ('title', 'lines', 'duration', 'summary', 'thumb', 'state',
+                 'progress', 'is_hub')
+
+    def __init__(self, item):
+        if item.__class__.__name__ == 'HubsItem':
+            self.title = hub_title(item)
+        elif isinstance(item, plexdevices.hubs.Hub):
+            self.title = item.title.upper()
+        else:
+            self.title = title(item)
+        self.lines = tile_lines(item)
+        self.duration = (timestamp_from_ms(item.duration, minimal=True)
+                         if hasattr(item, 'duration') else '')
+        self.summary = getattr(item, 'summary', '') or ''
+        self.thumb = getattr(item, 'thumb', None)
+        self.state = thumb_state(item)
+        self.progress = (self.state[2] / max(1, item.duration)
+                         if self.state is not None and self.state[1] else 0)
+        self.is_hub = isinstance(item, plexdevices.hubs.Hub)
+
+    @property
+    def summary_lines(self):
+        """number of lines under the title in tile mode"""
+        return len(self.lines) - 1
+
+
+def tile_lines(item):
+    """the title and the lines of text under it in tile mode"""
+    if isinstance(item, plexdevices.media.Episode):
+        return (item.grandparent_title, item.title,
+                'S{} E{}'.format(item.parent_index, item.index))
+    elif isinstance(item, plexdevices.media.Album):
+        return (item.parent_title, item.title)
+    elif isinstance(item, plexdevices.media.Movie):
+        return (item.title, str(item.year))
+    elif isinstance(item, plexdevices.media.Track):
+        return (item.title, timestamp_from_ms(item.duration, minimal=True))
+    else:
+        return (item.title,)
@@ -18,8 +18,6 @@ import logging
 import pickle
 import base64
 
-import requests
-
 import plexdevices
 
 from PyQt5 import QtCore
@@ -27,6 +25,7 @@ from PyQt5 import QtCore
 import plexdesktop.settings
 import plexdesktop.utils
 import plexdesktop.sqlcache
+import plexdesktop.httppool
 
 logger = logging.getLogger('plexdesktop')
 
@@ -128,18 +127,19 @@ class SessionManager(QtCore.QObject):
         logger.info('SessionManager: refreshing user thumbs')
         with plexdesktop.sqlcache.db_thumb() as cache:
             for user in self.session.users:
-                if user.thumb in cache:
+                if cache.get(user.thumb) is not None:
                     continue
                 try:
                     logger.info('getting thumb {}'.format(user.thumb))
-                    r = requests.get(user.thumb)
+                    r = plexdesktop.httppool.session().get(user.thumb, timeout=10)
                 except Exception:
                     logger.error(
                         'SessionManager: cache_user_thumbs {}'.format(user.thumb))
                 else:
                     if r.ok:
                         img_data = r.content
-                        cache[user.thumb] = img_data
+                        cache.set(user.thumb, img_data,
+                                  expire=plexdesktop.sqlcache.ttl())
 
     def delete_session(self):
         settings = plexdesktop.settings.Settings()
@@ -16,6 +16,20 @@
 
 import diskcache
 
+from plexdesktop.settings import Settings
+
+MB = 1024 * 1024
+
+EVICTION_POLICIES = ['least-recently-used', 'least-frequently-used',
+                     'least-recently-stored']
+
+# name: (directory, default size limit in MB)
+CACHES = {
+    'thumb': ('.cache_thumbs', 256),
+    'image': ('.cache_img', 1024),
+    'index': ('.cache_index', 64),
+}
+
 
 def db_thumb():
     return DB_THUMB
@@ -25,5 +39,84 @@ def db_image():
     return DB_IMAGE
 
 
-DB_THUMB = diskcache.Cache('.cache_thumbs')
-DB_IMAGE = diskcache.Cache('.cache_img')
+def db_index():
+    return DB_INDEX
+
+
+def caches():
+    return {'thumb': DB_THUMB, 'image': DB_IMAGE, 'index': DB_INDEX}
+
+
+def index_key(server, key, page, size, params):
+    """Key of a container listing in the metadata index."""
+    return (server.client_identifier, key, page, size,
+            tuple(sorted(params.items())))
+
+
+def forget_index(server, key, page, size, params):
+    """Drop a container listing from the metadata index, so it's fetched from
+    the server next time."""
+    db_index().delete(index_key(server, key, page, size, params))
+
+
+def index_data(container):
+    """Return the raw data of `container` to store in the metadata index.
+    ``MediaContainer(server, data)`` turns it back into a container."""
+    data = dict(container.data)
+    data['_children'] = [item.data for item in container.children]
+    return data
+
+
+def ttl():
+    """Seconds before a cached item is fetched from the server again, or
+    None to keep items until they are evicted."""
+    days = float(Settings().value('cache_ttl_days', 30))
+    return days * 24 * 60 * 60 if days > 0 else None
+
+
+def _options(name):
+    s = Settings()
+    return {
+        'size_limit': int(s.value('cache_{}_mb'.format(name),
+                                  CACHES[name][1])) * MB,
+        'eviction_policy': s.value('cache_eviction', EVICTION_POLICIES[0]),
+    }
+
+
+def open_cache(name):
+    # cull_limit=0 keeps eviction out of set(), it's done in the background
+    # by plexdesktop.workers.CacheWorker instead.
+    cache = diskcache.Cache(CACHES[name][0], cull_limit=0, **_options(name))
+    cache.stats(enable=True)
+    return cache
+
+
+def configure():
+    """Apply the cache settings to the open caches."""
+    for name, cache in caches().items():
+        for key, value in _options(name).items():
+            cache.reset(key, value)
+
+
+def stats():
+    """Return ``{name: (hits, misses, bytes, count, limit)}`` for each cache."""
+    result = {}
+    for name, cache in caches().items():
+        hits, misses = cache.stats()
+        result[name] = (hits, misses, cache.volume(), len(cache),
+                        cache.size_limit)
+    return result
+
+
+def trim(name=None):
+    """Remove expired items and evict items until each cache is under its
+    size limit. This can take a while, don't call it on the GUI thread."""
+    for cache_name, cache in caches().items():
+        if name is None or name == cache_name:
+            cache.expire()
+            cache.cull()
+
+
+DB_THUMB = open_cache('thumb')
+DB_IMAGE = open_cache('image')
+DB_INDEX = open_cache('index')
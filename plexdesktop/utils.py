@@ -15,6 +15,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import queue
+import functools
+import collections
+
 import plexdevices
 
 from PyQt5 import QtWidgets
@@ -28,6 +31,17 @@ def timestamp_from_ms(milliseconds, minimal=False):
     return '{:.0f}:{:02.0f}:{:02.0f}'.format(h, m, s)
 
 
+def contiguous_ranges(numbers):
+    """Group `numbers` into a list of (first, last) runs of consecutive ints"""
+    ranges = []
+    for n in sorted(numbers):
+        if ranges and n == ranges[-1][1] + 1:
+            ranges[-1][1] = n
+        else:
+            ranges.append([n, n])
+    return [tuple(r) for r in ranges]
+
+
 def msg_box(message, title='plexdesktop'):
     msg = QtWidgets.QMessageBox()
     msg.setText(message)
@@ -35,6 +49,70 @@ def msg_box(message, title='plexdesktop'):
     msg.exec_()
 
 
+# formatted titles by (function, server, ratingKey, the fields they're made
+# of, container flags)
+TITLE_CACHE_SIZE = 4096
+_titles = collections.OrderedDict()
+
+# the item data title() and hub_title() read. Some of it can change without a
+# new updatedAt, e.g. a season's viewedLeafCount, so it's part of the key
+TITLE_FIELDS = ('title', 'parentTitle', 'grandparentTitle', 'index',
+                'parentIndex', 'year', 'rating', 'tag', 'leafCount',
+                'viewedLeafCount')
+# what items fall back to when they don't have it themselves
+TITLE_CONTAINER_FIELDS = ('parentTitle', 'grandparentTitle', 'parentIndex')
+
+
+def _title_key(func, media):
+    data = getattr(media, 'data', None)
+    rating_key = None if data is None else data.get('ratingKey')
+    if rating_key is None:
+        return None
+    # hub items don't always belong to a MediaContainer
+    container = getattr(media, 'container', None)
+    server = getattr(getattr(container, 'server', None), 'client_identifier', None)
+    container_data = getattr(container, 'data', None) or {}
+    flags = tuple(getattr(container, flag, None) for flag in
+                  ('filters', 'is_library', 'mixed_parents'))
+    return (func.__name__, server, rating_key, type(media).__name__,
+            tuple(data.get(field) for field in TITLE_FIELDS),
+            tuple(container_data.get(field) for field in TITLE_CONTAINER_FIELDS),
+            flags)
+
+
+def memoize_title(func):
+    """Remember what `func` returned for an item, as long as the item has a
+    ratingKey to tell it apart. See :func:`invalidate_titles`."""
+    @functools.wraps(func)
+    def wrapper(media):
+        key = _title_key(func, media)
+        if key is None:
+            return func(media)
+        try:
+            _titles.move_to_end(key)
+            return _titles[key]
+        except KeyError:
+            pass
+        t = func(media)
+        _titles[key] = t
+        if len(_titles) > TITLE_CACHE_SIZE:
+            _titles.popitem(last=False)
+        return t
+    return wrapper
+
+
+def invalidate_titles(media=None):
+    """Forget the remembered titles of `media`, or of everything if it's None.
+    A changed item gets a new key anyway, this frees the old ones."""
+    if media is None:
+        _titles.clear()
+        return
+    rating_key = media.data.get('ratingKey')
+    for key in [k for k in _titles if k[2] == rating_key]:
+        del _titles[key]
+
+
+@memoize_title
 def title(media):
     container = media.container
     if isinstance(media, plexdevices.media.Directory):
@@ -66,6 +144,7 @@ def title(media):
             return media.title
 
 
+@memoize_title
 def hub_title(media):
     if isinstance(media, plexdevices.media.Directory):
         if isinstance(media, plexdevices.media.Season):
@@ -15,50 +15,165 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import errno
 import logging
 import time
+import functools
+import collections
+import http.client
+import concurrent.futures
 
 import requests
+import urllib3
 import plexdevices
 
 from PyQt5 import QtCore, QtGui
 
 import plexdesktop.sqlcache
+import plexdesktop.imagecache
+import plexdesktop.httppool
+import plexdesktop.downloads
+import plexdesktop.utils
 from plexdesktop.settings import Settings
 
 logger = logging.getLogger('plexdesktop')
 
 
 class ContainerWorker(QtCore.QObject):
-    result_ready = QtCore.pyqtSignal(plexdevices.media.MediaContainer)
+    result_ready = QtCore.pyqtSignal(int, plexdevices.media.MediaContainer)
+    result_updated = QtCore.pyqtSignal(int, plexdevices.media.MediaContainer)
+    stream_started = QtCore.pyqtSignal(int, plexdevices.media.MediaContainer)
+    rows_ready = QtCore.pyqtSignal(int, plexdevices.media.MediaContainer, bool)
     container_updated = QtCore.pyqtSignal(plexdevices.media.MediaContainer, int)
+    page_ready = QtCore.pyqtSignal(int, int, plexdevices.media.MediaContainer)
+    page_failed = QtCore.pyqtSignal(int, int)
+    request_done = QtCore.pyqtSignal(int)
     finished = QtCore.pyqtSignal()
 
-    def run(self, server, key, page=0, size=20, sort="", params={}):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # the newest request id, set from the GUI thread. queued requests
+        # with an older id have been superseded and are skipped.
+        self.latest = 0
+
+    def run(self, server, key, page=0, size=20, sort="", params={}, request_id=0,
+            fresh=False):
+        """Fetch a container for request `request_id`, from the server only if
+        `fresh`. ``request_done`` is emitted when it's over, whether it worked
+        or not."""
+        try:
+            self._run(server, key, page, size, sort, params, request_id, fresh)
+        finally:
+            self.request_done.emit(request_id)
+            self.finished.emit()
+
+    def _run(self, server, key, page, size, sort, params, request_id, fresh):
+        if request_id != self.latest:
+            logger.debug('ContainerWorker: skipping superseded request: key={}'.format(key))
+            return
         logger.debug(('ContainerWorker: fetching container: key={}, server={}, '
                       'page={}, size={}, sort={}, params={}').format(key, server, page,
                                                                      size, sort, params))
         p = {} if not sort else {'sort': sort}
         if params:
             p.update(params)
+        index = plexdesktop.sqlcache.db_index()
+        index_key = plexdesktop.sqlcache.index_key(server, key, page, size, p)
+        indexed = None if fresh else index.get(index_key)
+        if indexed is not None:
+            # show what we had last time, then fetch it again and compare.
+            # the container's updatedAt and totalSize don't change when an
+            # item is watched, so they can't tell if it's still current.
+            # MediaContainer takes the children out of the dict it gets
+            self.result_ready.emit(request_id,
+                                   plexdevices.media.MediaContainer(server, dict(indexed)))
+            try:
+                container = plexdesktop.httppool.media_container(server, key, size, page, p)
+            except (ConnectionError, requests.exceptions.RequestException,
+                    plexdevices.DeviceConnectionsError) as e:
+                logger.error('ContainerWorker: revalidate: {}'.format(e))
+                return
+            data = plexdesktop.sqlcache.index_data(container)
+            if data != indexed:
+                logger.debug('ContainerWorker: {} changed'.format(key))
+                if request_id == self.latest:
+                    self.result_updated.emit(request_id, container)
+                index.set(index_key, data, expire=plexdesktop.sqlcache.ttl())
+            return
         try:
-            container = server.media_container(key, size, page, p, timeout=5)
-        except (ConnectionError, requests.exceptions.RequestException) as e:
+            if server.active is not None and bool(int(Settings().value('stream_containers', 1))):
+                data = self._stream(server, key, page, size, p, request_id)
+            else:
+                container = plexdesktop.httppool.media_container(server, key, size, page, p)
+                data = plexdesktop.sqlcache.index_data(container)
+                self.result_ready.emit(request_id, container)
+        except (ConnectionError, requests.exceptions.RequestException,
+                plexdevices.DeviceConnectionsError) as e:
             logger.error('ContainerWorker: {}, {}'.format(repr(e), e))
         else:
-            self.result_ready.emit(container)
-        self.finished.emit()
+            if data is not None and data.get('identifier') == 'com.plexapp.plugins.library':
+                index.set(index_key, data, expire=plexdesktop.sqlcache.ttl())
+
+    def _stream(self, server, key, page, size, params, request_id):
+        """Fetch a container with :func:`plexdesktop.httppool.iter_media_container`.
+        The first chunk of children is sent with ``stream_started``, the
+        ones after it with ``rows_ready``. The first chunk is small so it
+        comes before the end of a page. Returns the whole container's data,
+        or None if the request was superseded on the way."""
+        s = Settings()
+        chunk = int(s.value('stream_chunk', 200))
+        first_chunk = int(s.value('stream_first_chunk', 25))
+        everything = None
+        chunks = plexdesktop.httppool.iter_media_container(
+            server, key, size, page, params, chunk=chunk,
+            first_chunk=first_chunk, timeout=30)
+        try:
+            for header, children in chunks:
+                if request_id != self.latest:
+                    chunks.close()
+                    return None
+                container = plexdevices.media.MediaContainer(
+                    server, dict(header, _children=list(children)))
+                if everything is None:
+                    everything = dict(header, _children=list(children))
+                    self.stream_started.emit(request_id, container)
+                else:
+                    everything['_children'].extend(children)
+                    self.rows_ready.emit(request_id, container, False)
+        finally:
+            # the model stops waiting for rows, even if the response broke off
+            self.rows_ready.emit(request_id, plexdevices.media.MediaContainer(server, {}), True)
+        return everything
 
     def fetch_more(self, container):
         start_len = len(container)
         try:
             container.fetch_more()
-        except (ConnectionError, requests.exceptions.RequestException) as e:
+        except (ConnectionError, requests.exceptions.RequestException,
+                plexdevices.DeviceConnectionsError) as e:
             logger.error('ContainerWorker: fetch_more(): {}'.format(e))
         else:
             self.container_updated.emit(container, len(container) - start_len)
         self.finished.emit()
 
+    def fetch_page(self, server, key, page, size, sort, params, generation):
+        """Fetch one page of a container, for a model that keeps only the
+        pages near its viewport. `generation` is passed back untouched so the
+        model can drop pages of a container it no longer shows."""
+        logger.debug('ContainerWorker: fetching page {} of {}'.format(page, key))
+        p = {} if not sort else {'sort': sort}
+        if params:
+            p.update(params)
+        try:
+            container = plexdesktop.httppool.media_container(server, key, size, page, p)
+        except (ConnectionError, requests.exceptions.RequestException,
+                plexdevices.DeviceConnectionsError) as e:
+            logger.error('ContainerWorker: fetch_page(): {}'.format(e))
+            self.page_failed.emit(generation, page)
+        else:
+            self.page_ready.emit(generation, page, container)
+        self.finished.emit()
+
     # def fetch_next_page_object(self, container):
     #     start_len = len(container)
     #     try:
@@ -70,6 +185,80 @@ class ContainerWorker(QtCore.QObject):
     #     self.finished.emit()
 
 
+class PrefetchWorker(QtCore.QObject):
+    """Fetch what the user is likely to open next into the caches the real
+    fetches read first: containers into the metadata index, thumbs into the
+    thumb cache. See :class:`plexdesktop.prefetch.Prefetcher`."""
+    container_ready = QtCore.pyqtSignal(int, plexdevices.media.MediaContainer)
+    done = QtCore.pyqtSignal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # jobs of older generations were queued before the user did
+        # something, and are skipped
+        self.latest = 0
+
+    def container(self, server, key, size, sort, params, generation):
+        """Put the container :meth:`ContainerWorker.run` would fetch for
+        these arguments in the metadata index, unless it's there already."""
+        try:
+            if generation == self.latest:
+                self._container(server, key, size, sort, params, generation)
+        finally:
+            self.done.emit(generation)
+
+    def _container(self, server, key, size, sort, params, generation):
+        p = {} if not sort else {'sort': sort}
+        if params:
+            p.update(params)
+        index = plexdesktop.sqlcache.db_index()
+        index_key = plexdesktop.sqlcache.index_key(server, key, 0, size, p)
+        data = index.get(index_key)
+        try:
+            if data is None:
+                logger.debug('PrefetchWorker: {}'.format(key))
+                container = plexdesktop.httppool.media_container(server, key, size, 0, p)
+                if container.is_library:
+                    index.set(index_key, plexdesktop.sqlcache.index_data(container),
+                              expire=plexdesktop.sqlcache.ttl())
+            else:
+                container = plexdevices.media.MediaContainer(server, data)
+        except (ConnectionError, requests.exceptions.RequestException,
+                plexdevices.DeviceConnectionsError) as e:
+            logger.debug('PrefetchWorker: {}: {}'.format(key, e))
+        else:
+            self.container_ready.emit(generation, container)
+
+    def page(self, worker, args, generation):
+        """Run ``worker.fetch_page(*args)``, so a model gets a page before
+        it's scrolled to."""
+        try:
+            if generation == self.latest:
+                worker.fetch_page(*args)
+        finally:
+            self.done.emit(generation)
+
+    def thumb(self, item, thumb_size, generation):
+        """Put the thumb of `item` in the thumb cache."""
+        try:
+            if generation == self.latest:
+                self._thumb(item, thumb_size)
+        finally:
+            self.done.emit(generation)
+
+    @staticmethod
+    def _thumb(item, thumb_size):
+        cache = plexdesktop.sqlcache.db_thumb()
+        if cache.get(item.thumb) is None:
+            try:
+                img_data = ThumbPool.Instance().fetch(item, thumb_size)
+            except (ConnectionError, requests.exceptions.RequestException,
+                    plexdevices.DeviceConnectionsError) as e:
+                logger.debug('PrefetchWorker: {}: {}'.format(item.thumb, e))
+            else:
+                cache.set(item.thumb, img_data, expire=plexdesktop.sqlcache.ttl())
+
+
 class HubWorker(QtCore.QObject):
     result_ready = QtCore.pyqtSignal(plexdevices.hubs.HubsContainer)
     finished = QtCore.pyqtSignal()
@@ -93,68 +282,324 @@ class ImageWorker(QtCore.QObject):
         url = photo_object.media[0].parts[0].resolve_key()
         logger.info('ImageWorker: ' + url)
         with plexdesktop.sqlcache.db_image() as cache:
-            if url in cache:
-                img_data = cache[url]
-            else:
+            img_data = cache.get(url)
+            if img_data is None:
+                server = photo_object.container.server
                 try:
-                    res = photo_object.container.server.image(url)
+                    if url.startswith('http'):
+                        res = plexdesktop.httppool.session().get(url, timeout=30)
+                        res.raise_for_status()
+                    elif server.active is None:
+                        res = server.image(url)
+                    else:
+                        res = plexdesktop.httppool.get(server, url, timeout=30)
                 except (ConnectionError, requests.exceptions.RequestException) as e:
                     logger.error('ImageWorker: {}'.format(e))
                     return
                 else:
                     img_data = res.content
-                    cache[url] = img_data
+                    cache.set(url, img_data, expire=plexdesktop.sqlcache.ttl())
         self.signal.emit(QtCore.QByteArray(img_data))
 
 
-# class ThumbTask(QtCore.QRunnable):
-
-#     def __init__(self, receiver, item, row):
-#         super().__init__()
-#         self.receiver = receiver
-#         self.item = item
-#         self.row = row
-#         self.setAutoDelete(True)
-#         self.thumb_size = 240
-
-#     def run(self):
-#         if not self.item:
-#             return
-#         url = self.item.thumb
-#         if not url:
-#             return
-#         img = QtGui.QPixmapCache.find(url)
-#         if img:
-#             return
-#         with plexdesktop.sqlcache.db_thumb() as cache:
-#             if url in cache:
-#                 img_data = cache[url]
-#             else:  # not in cache, fetch from server
-#                 try:
-#                     if self.item.container.is_library:
-#                         res = self.item.container.server.image(
-#                             url, self.thumb_size, self.thumb_size, timeout=5)
-#                     else:
-#                         res = self.item.container.server.image(url, timeout=5)
-#                 except (ConnectionError, requests.exceptions.RequestException) as e:
-#                     logger.error('QueueThumbWorker: {}'.format(e))
-#                     return
-#                 else:
-#                     img_data = res.content
-#                     cache[url] = img_data
-#             img = QtGui.QPixmap()
-#             img.loadFromData(img_data)
-#             QtGui.QPixmapCache.insert(url, img)
-#             QtCore.QMetaObject.invokeMethod(
-#                 self.receiver,
-#                 "_update_thumb",
-#                 QtCore.Qt.QueuedConnection,
-#                 QtCore.Q_ARG(int, self.row),
-#                 QtCore.Q_ARG(object, self.item)
-#             )
+class FetchTask(QtCore.QRunnable):
+    """Run one :class:`FetchService` job on a pool thread."""
+
+    def __init__(self, service, client, func, args):
+        super().__init__()
+        self.service = service
+        self.client = client
+        self.func = func
+        self.args = args
+        self.setAutoDelete(True)
+
+    def run(self):
+        try:
+            self.func(*self.args)
+        except Exception as e:
+            logger.error('FetchTask: {}: {}'.format(self.func.__name__, e))
+        finally:
+            self.service.task_done.emit(self.client)
+
+
+class FetchService(QtCore.QObject):
+    """Run the container, hub and image fetches of every window on one
+    bounded pool of threads, instead of a thread per view.
+
+    Each client (a tab's model, the hub tree, a photo viewer) has its own
+    queue. Clients take turns when a thread is free, except the foreground
+    client which always goes first. A client's jobs run one at a time and in
+    order, as they did on its own thread. The functions run on pool threads,
+    so they report back with signals like the workers above.
+    """
+    task_done = QtCore.pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(int(Settings().value('fetch_workers', 4)))
+        # client: deque of (key, func, args), in turn order
+        self._queues = collections.OrderedDict()
+        self._foreground = None
+        # clients served only when no other client is waiting
+        self._background = set()
+        # clients with a job running
+        self._busy = set()
+        self.task_done.connect(self._task_done, QtCore.Qt.QueuedConnection)
+
+    def submit(self, client, func, *args, key=None):
+        """Call ``func(*args)`` on a pool thread for `client`. A queued job of
+        the same client with the same `key` is replaced, it's out of date."""
+        queue = self._queues.setdefault(client, collections.deque())
+        if key is not None:
+            for job in queue:
+                if job[0] == key:
+                    queue.remove(job)
+                    break
+        queue.append((key, func, args))
+        self._dispatch()
+
+    def forget(self, client):
+        """Drop the queued jobs of `client`, e.g. when it closes."""
+        self._queues.pop(client, None)
+        if self._foreground is client:
+            self._foreground = None
+
+    def set_foreground(self, client):
+        self._foreground = client
+
+    def set_background(self, client, background=True):
+        """Only run the jobs of `client` when no other client has any
+        queued, e.g. for speculative fetches."""
+        if background:
+            self._background.add(client)
+        else:
+            self._background.discard(client)
+
+    def busy(self):
+        """True if a client that isn't in the background has jobs waiting."""
+        return any(queue for client, queue in self._queues.items()
+                   if client not in self._background)
+
+    def quit(self):
+        self._queues.clear()
+        self.pool.waitForDone(5000)
+
+    def _next(self):
+        """The next (client, job) to run, or None."""
+        client = self._foreground
+        queue = self._queues.get(client)
+        if queue and client not in self._busy:
+            return client, queue.popleft()
+        for background in (False, True):
+            for client, queue in self._queues.items():
+                if (queue and client not in self._busy and
+                        (client in self._background) == background):
+                    self._queues.move_to_end(client)
+                    return client, queue.popleft()
+        return None
+
+    def _dispatch(self):
+        while len(self._busy) < self.pool.maxThreadCount():
+            job = self._next()
+            if job is None:
+                break
+            client, (_, func, args) = job
+            self._busy.add(client)
+            self.pool.start(FetchTask(self, client, func, args))
+
+    def _task_done(self, client):
+        self._busy.discard(client)
+        self._dispatch()
+
+
+def decode_image(img_data, max_size=None):
+    """Return a QImage from `img_data`, scaled down to fit in a `max_size`
+    square while decoding if it is larger. Safe to call off the GUI thread."""
+    buf = QtCore.QBuffer()
+    buf.setData(QtCore.QByteArray(img_data))
+    reader = QtGui.QImageReader(buf)
+    size = reader.size()
+    if max_size and size.isValid() and max(size.width(), size.height()) > max_size:
+        reader.setScaledSize(size.scaled(max_size, max_size,
+                                         QtCore.Qt.KeepAspectRatio))
+    return reader.read()
+
+
+class ThumbTask(QtCore.QRunnable):
+    """Fetch and decode one thumbnail on a :class:`ThumbPool` thread."""
+
+    def __init__(self, pool, item, thumb_size):
+        super().__init__()
+        self.pool = pool
+        self.item = item
+        self.thumb_size = thumb_size
+        self.setAutoDelete(True)
+
+    def run(self):
+        url = self.item.thumb
+        memory = plexdesktop.imagecache.thumbs()
+        img = memory.get((url, self.thumb_size))
+        if img is None:
+            try:
+                img = self._load(url)
+            except Exception as e:  # don't take the pool thread down with it
+                logger.error('ThumbTask: {}: {}'.format(url, repr(e)))
+                img = None
+            if img is not None:
+                memory.put((url, self.thumb_size), img)
+        self.pool.loaded.emit((url, self.thumb_size), img)
+
+    def _load(self, url):
+        cache = plexdesktop.sqlcache.db_thumb()
+        img_data = cache.get(url)
+        if img_data is None:  # not in cache, fetch from server
+            try:
+                img_data = self.pool.fetch(self.item, self.thumb_size)
+            except (ConnectionError, requests.exceptions.RequestException,
+                    plexdevices.DeviceConnectionsError) as e:
+                logger.error('ThumbTask: {}'.format(e))
+                return None
+            else:
+                cache.set(url, img_data, expire=plexdesktop.sqlcache.ttl())
+        img = decode_image(img_data, self.thumb_size)
+        if img.isNull():
+            logger.error('ThumbTask: unable to decode {}'.format(url))
+            return None
+        return img
+
+
+@plexdesktop.utils.Singleton
+class ThumbPool(QtCore.QObject):
+    """A bounded pool of threads shared by every model that needs thumbnails.
+
+    Models don't submit to the pool directly, they own a
+    :class:`QueueThumbWorker` which feeds it. Finished images are collected
+    and turned into pixmaps together once per event loop iteration.
+
+    Each url is only fetched once at a time, no matter how many rows or
+    models ask for it. A url that fails is retried with exponential backoff
+    and given up on for a while after `MAX_ATTEMPTS`.
+    """
+    loaded = QtCore.pyqtSignal(object, object)
+
+    MAX_ATTEMPTS = 5
+    RETRY_DELAY = 2  # seconds, doubled after each failed attempt
+    FAILED_DELAY = 10 * 60  # seconds before trying a url that gave up again
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        s = Settings()
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(int(s.value('thumb_workers', 4)))
+        self._ready = []
+        # (url, thumb size): [(receiver, row, item), ...] waiting for it
+        self._waiting = {}
+        # (url, thumb size): (failed attempts, time of the next attempt)
+        self._failures = {}
+        self._flush_timer = QtCore.QTimer(self)
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.setInterval(0)
+        self._flush_timer.timeout.connect(self._flush)
+        self.loaded.connect(self._loaded, QtCore.Qt.QueuedConnection)
+
+    @property
+    def max_workers(self):
+        return self.pool.maxThreadCount()
+
+    def set_max_workers(self, count):
+        self.pool.setMaxThreadCount(max(1, int(count)))
+
+    def request(self, receiver, item, row, thumb_size):
+        """Load the thumb of `item` for `receiver`, ``receiver._loaded`` is
+        called with the result. Returns False without doing anything if the
+        url failed and is waiting for its next attempt."""
+        key = (item.thumb, thumb_size)
+        if key in self._waiting:
+            self._waiting[key].append((receiver, row, item))
+            return True
+        if self.failed(item, thumb_size):
+            return False
+        self._waiting[key] = [(receiver, row, item)]
+        self.pool.start(ThumbTask(self, item, thumb_size))
+        return True
+
+    def failed(self, item, thumb_size):
+        """True if the thumb of `item` has failed to load and isn't due for
+        another attempt yet."""
+        attempts, retry_at = self._failures.get((item.thumb, thumb_size), (0, 0))
+        return retry_at > time.monotonic()
+
+    def fetch(self, item, thumb_size):
+        """Download the image data of ``item.thumb``. Runs on a pool thread."""
+        url = item.thumb
+        server = item.container.server
+        transcode = item.container.is_library
+        if server.active is None:  # let plexdevices find a connection first
+            if transcode:
+                res = server.image(url, thumb_size, thumb_size, timeout=5)
+            else:
+                res = server.image(url, timeout=5)
+            return res.content
+        if url.startswith('http'):
+            res = plexdesktop.httppool.session().get(url, timeout=5)
+            res.raise_for_status()
+        else:
+            endpoint, params = (('/photo/:/transcode',
+                                 {'url': url, 'width': thumb_size,
+                                  'height': thumb_size, 'maxSize': 1})
+                                if transcode else (url, None))
+            res = plexdesktop.httppool.get(server, endpoint, params=params)
+        return res.content
+
+    @QtCore.pyqtSlot(object, object)
+    def _loaded(self, key, img):
+        self._ready.append((key, img))
+        if not self._flush_timer.isActive():
+            self._flush_timer.start()
+
+    def _flush(self):
+        ready, self._ready = self._ready, []
+        for (url, thumb_size), img in ready:
+            if img is not None:
+                QtGui.QPixmapCache.insert(url, QtGui.QPixmap.fromImage(img))
+        for key, img in ready:
+            waiting = self._waiting.pop(key, [])
+            if img is None:
+                self._failed(key, waiting)
+            else:
+                self._failures.pop(key, None)
+            for receiver, row, item in waiting:
+                if not receiver.closed:
+                    receiver._loaded(row, item, img is not None)
+
+    def _failed(self, key, waiting):
+        attempts = self._failures.get(key, (0, 0))[0] + 1
+        if attempts < self.MAX_ATTEMPTS:
+            delay = self.RETRY_DELAY * 2 ** (attempts - 1)
+            # ask again for whoever still wants it once the delay is over
+            QtCore.QTimer.singleShot(int(delay * 1000),
+                                     functools.partial(self._retry, key, waiting))
+        else:
+            logger.debug('ThumbPool: giving up on {}'.format(key[0]))
+            delay, attempts = self.FAILED_DELAY, 0
+        self._failures[key] = (attempts, time.monotonic() + delay)
+
+    def _retry(self, key, waiting):
+        attempts, retry_at = self._failures.get(key, (0, 0))
+        self._failures[key] = (attempts, 0)
+        for receiver, row, item in waiting:
+            if not receiver.closed:
+                receiver.get_thumb(item, row)
 
 
 class QueueThumbWorker(QtCore.QObject):
+    """Queue thumbnails for a model and load them into the QPixmapCache using
+    the shared :class:`ThumbPool`. ``result_ready`` is emitted for each one.
+
+    Requests are submitted in order of distance from the window set with
+    :meth:`set_window`, rows in the window first.
+    """
     result_ready = QtCore.pyqtSignal(int, plexdevices.media.BaseObject)
     finished = QtCore.pyqtSignal()
 
@@ -162,96 +607,210 @@ class QueueThumbWorker(QtCore.QObject):
         super().__init__(parent)
         s = Settings()
         self.thumb_size = int(s.value('thumb_size', 240))
+        self.pool = ThumbPool.Instance()
+        self.pending = {}
+        self.in_flight = set()
+        self.window = (0, -1)
+        self.prefetch = 0
+        self.closed = False
+
+    def cached(self, item):
+        """Return the thumb of `item` as a QPixmap if it's in memory, or None."""
+        img = QtGui.QPixmapCache.find(item.thumb)
+        if img:
+            return img
+        img = plexdesktop.imagecache.thumbs().get((item.thumb, self.thumb_size))
+        if img is None:
+            return None
+        img = QtGui.QPixmap.fromImage(img)
+        QtGui.QPixmapCache.insert(item.thumb, img)
+        return img
+
+    def failed(self, item):
+        return self.pool.failed(item, self.thumb_size)
 
     def get_thumb(self, item, row):
-        if not item:
+        if not item or not item.thumb or self.closed:
             return
-        url = item.thumb
-        if not url:
+        key = (row, id(item))
+        if key in self.in_flight or key in self.pending:
             return
-        img = QtGui.QPixmapCache.find(url)
-        if img:
+        self.pending[key] = item
+        self._dispatch()
+
+    def set_window(self, first, last, prefetch=0):
+        """Prioritise rows ``first`` to ``last`` and drop pending requests
+        more than ``prefetch`` rows away from them."""
+        self.window = (first, last)
+        self.prefetch = prefetch
+        for key in [k for k in self.pending if self._distance(k[0]) > prefetch]:
+            del self.pending[key]
+        self._dispatch()
+
+    def clear(self):
+        """Forget everything that hasn't been submitted to the pool yet."""
+        self.pending.clear()
+        self.window = (0, -1)
+
+    def quit(self):
+        self.closed = True
+        self.pending.clear()
+        self.finished.emit()
+
+    def _distance(self, row):
+        first, last = self.window
+        if last < first:  # no window yet, lowest rows first
+            return 0
+        return first - row if row < first else max(0, row - last)
+
+    def _dispatch(self):
+        # only keep as many requests in the pool as it has threads, so the
+        # priorities still mean something when the window moves.
+        while self.pending and len(self.in_flight) < self.pool.max_workers:
+            key = min(self.pending, key=lambda k: (self._distance(k[0]), k[0]))
+            item = self.pending.pop(key)
+            if self.pool.request(self, item, key[0], self.thumb_size):
+                self.in_flight.add(key)
+
+    def _loaded(self, row, item, success):
+        # emitted on failure too, so the row can show that it failed
+        self.in_flight.discard((row, id(item)))
+        self.result_ready.emit(row, item)
+        self._dispatch()
+
+
+class CacheWorker(QtCore.QObject):
+    finished = QtCore.pyqtSignal()
+
+    def trim(self, name=''):
+        logger.debug('CacheWorker: trimming {}'.format(name or 'all caches'))
+        try:
+            plexdesktop.sqlcache.trim(name or None)
+        except Exception as e:
+            logger.error('CacheWorker: {}'.format(e))
+        self.finished.emit()
+
+
+@plexdesktop.utils.Singleton
+class CacheMaintenance(QtCore.QObject):
+    """Periodically expire and evict disk cache items on a background thread.
+    Emit ``trim`` with a cache name, or '' for all of them, to do it now."""
+    trim = QtCore.pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.thread = QtCore.QThread()
+        self.worker = CacheWorker()
+        self.worker.moveToThread(self.thread)
+        self.trim.connect(self.worker.trim)
+        self.thread.start()
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(10 * 60 * 1000)
+        self.timer.timeout.connect(self.trim_all)
+        self.timer.start()
+
+    def trim_all(self):
+        self.trim.emit('')
+
+    def quit(self):
+        self.timer.stop()
+        self.thread.quit()
+        self.thread.wait()
+
+
+class DownloadRestorer(QtCore.QObject):
+    """Look up the item of a download that didn't finish last time."""
+    item_ready = QtCore.pyqtSignal(object, str)
+
+    def run(self, server, key, destination):
+        container = plexdesktop.httppool.media_container(server, key)
+        if not container.children:
+            logger.error('DownloadRestorer: {} is gone'.format(key))
             return
-        with plexdesktop.sqlcache.db_thumb() as cache:
-            if url in cache:
-                img_data = cache[url]
-            else:  # not in cache, fetch from server
-                try:
-                    if item.container.is_library:
-                        res = item.container.server.image(
-                            url, self.thumb_size, self.thumb_size, timeout=5)
-                    else:
-                        res = item.container.server.image(url, timeout=5)
-                except (ConnectionError, requests.exceptions.RequestException) as e:
-                    logger.error('QueueThumbWorker: {}'.format(e))
-                    return
-                else:
-                    img_data = res.content
-                    cache[url] = img_data
+        self.item_ready.emit(container.children[0], destination)
 
-            img = QtGui.QPixmap()
-            img.loadFromData(img_data)
-            QtGui.QPixmapCache.insert(url, img)
-            self.result_ready.emit(row, item)
 
-    def process(self, queue):
-        """Load images into the QPixmapCache"""
-        s = Settings()
-        thumb_size = int(s.value('thumb_size', 200))
-        cache = plexdesktop.sqlcache.db_thumb()
-        # while True:
-        for (media_object, row) in iter(queue.get, None):
-            if not media_object:
-                continue
-            url = media_object.thumb
-            if not url:
-                continue
-            if url in cache:
-                img_data = cache[url]
-            else:  # not in cache, fetch from server
-                try:
-                    if media_object.container.is_library:
-                        res = media_object.container.server.image(
-                            url, thumb_size, thumb_size, timeout=5)
-                    else:
-                        res = media_object.container.server.image(url, timeout=5)
-                except (ConnectionError, requests.exceptions.RequestException) as e:
-                    logger.error('QueueThumbWorker: {}'.format(e))
-                    cache.close()
-                    continue
-                else:
-                    img_data = res.content
-                    cache[url] = img_data
+class BatchExpander(QtCore.QObject):
+    """Find every file under a show, season, album or artist."""
+    expanded = QtCore.pyqtSignal(object, list, str, int)
 
-            img = QtGui.QPixmap()
-            img.loadFromData(img_data)
-            QtGui.QPixmapCache.insert(url, img)
-            self.result_ready.emit(row, media_object)
-        # cache.close()
+    def run(self, item, destination):
+        """Fetch the children of `item`, then of all its sub-directories at
+        once, a level at a time, until only playable items are left.
+        Directories that can't be fetched are skipped and counted."""
+        server = item.container.server
+        items, level, failed = [], [item], 0
+        workers = int(Settings().value('fetch_workers', 4))
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            while level:
+                containers = pool.map(lambda d: self._fetch(server, d), level)
+                level = []
+                for container in containers:
+                    if container is None:
+                        failed += 1
+                        continue
+                    for child in container.children:
+                        if isinstance(child, plexdevices.media.MediaItem):
+                            if child.media:
+                                items.append(child)
+                        elif (isinstance(child, plexdevices.media.Directory) and
+                              not child.key.endswith('/allLeaves')):
+                            # "All episodes" lists the seasons' episodes again
+                            level.append(child)
+        logger.debug('BatchExpander: {} files in {}'.format(len(items), item.key))
+        self.expanded.emit(item, items, destination, failed)
+
+    @staticmethod
+    def _fetch(server, directory):
+        try:
+            return plexdesktop.httppool.media_container(server, directory.key, timeout=30)
+        except (ConnectionError, requests.exceptions.RequestException,
+                plexdevices.DeviceConnectionsError) as e:
+            logger.error('BatchExpander: {}: {}'.format(directory.key, e))
+            return None
 
 
 class DownloadJob(QtCore.QObject):
-    def __init__(self, mutex, item, destination, parent=None):
+    """One file to download, and the state the :class:`DownloadScheduler`
+    and the window share with the worker downloading it."""
+    resumed = QtCore.pyqtSignal()
+
+    def __init__(self, item, destination, priority=0, parent=None):
         super().__init__(parent)
         self.id = hash(item)
         self.item = item
         self.destination = destination
+        self.server = item.container.server.client_identifier
+        self.priority = priority
         self.cancelled = False
+        self.stopped = False  # by quitting, it carries on next time
         self.paused = False
+        self.error = None  # why it failed, if it did
+        # the bandwidth limits it's under, set by the scheduler
+        self.buckets = ()
+        self.progress = plexdesktop.downloads.Progress()
+        self._mutex = QtCore.QMutex()
         self._pause = QtCore.QWaitCondition()
 
-        self.thread = QtCore.QThread()
-        self.worker = DownloadWorker(mutex)
-        self.worker.moveToThread(self.thread)
-        self.thread.start()
-
-    def quit(self):
-        self.thread.quit()
+    @property
+    def interrupted(self):
+        return self.cancelled or self.stopped
 
     def cancel(self):
         self.cancelled = True
         self.resume()
 
+    def retry(self):
+        """Make a job that failed ready to be scheduled again. It resumes
+        from its part file."""
+        self.error = None
+        self.cancelled = self.stopped = self.paused = False
+
+    def stop(self):
+        self.stopped = True
+        self.resume()
+
     def pause(self):
         self.paused = True
 
@@ -262,54 +821,454 @@ class DownloadJob(QtCore.QObject):
             self.paused = True
 
     def resume(self):
+        self._mutex.lock()
         self.paused = False
         self._pause.wakeAll()
+        self._mutex.unlock()
+        self.resumed.emit()
+
+    def wait_while_paused(self):
+        self._mutex.lock()
+        while self.paused and not self.interrupted:
+            self._pause.wait(self._mutex)
+        self._mutex.unlock()
+
+    def throttle(self, size):
+        """Wait until `size` more bytes fit in the bandwidth limits."""
+        for bucket in self.buckets:
+            bucket.consume(size)
 
 
 class DownloadWorker(QtCore.QObject):
-    progress = QtCore.pyqtSignal(DownloadJob, int, int)
     canceled = QtCore.pyqtSignal(DownloadJob)
     complete = QtCore.pyqtSignal(DownloadJob)
     paused = QtCore.pyqtSignal(DownloadJob)
 
-    def __init__(self, mutex, parent=None):
-        super().__init__(parent)
-        self.mutex = mutex
-
-    def download_file(self, queue, block_size=8192):
-        locker = QtCore.QMutexLocker(self.mutex)
-        while not queue.empty():
-            job = queue.get()
-            url = job.item.resolve_url()
-            file_name = job.item.media[0].parts[0].file_name
-            full_path = os.path.join(job.destination, file_name)
-            if job.paused:
-                self.paused.emit(job)
-                job._pause.wait(self.mutex)
+    SEGMENT_ATTEMPTS = 5
+    MIN_SEGMENT_SIZE = 8 * 1024 * 1024
+    MIN_BLOCK = 64 * 1024
+    MAX_BLOCK = 4 * 1024 * 1024
+
+    def download(self, job):
+        """Download `job`. Called on a :class:`DownloadScheduler` thread, so
+        several jobs can be downloading at once."""
+        url = job.item.resolve_url()
+        file_name = job.item.media[0].parts[0].file_name
+        full_path = os.path.join(job.destination, file_name)
+        self._wait_if_paused(job)
+        if job.interrupted:
             if job.cancelled:
                 self.canceled.emit(job)
-                return
-            with open(full_path, 'wb') as f:
-                response = requests.get(url, stream=True)
-                if not response.ok:
-                    return
-                file_size = int(response.headers['content-length'])
-                start_time = time.clock()
-                timer = start_time
-                downloaded = 0
-                rate = 0
-                for block in response.iter_content(block_size):
-                    f.write(block)
-                    downloaded += len(block)
-                    now = time.clock()
-                    if now - timer > 0.1:
-                        timer = now
-                        self.progress.emit(job, downloaded * 100.0 / file_size,
-                                           downloaded // (now - start_time))
-                        if job.paused:
-                            self.paused.emit(job)
-                            job._pause.wait(self.mutex)
-                        if job.cancelled:
-                            self.canceled.emit(job)
-                            return
-            self.complete.emit(job)
+            return
+        session = plexdesktop.httppool.session(job.item.container.server)
+        manifest = None
+        try:
+            size, ranges, etag = self._probe(session, url)
+            manifest = plexdesktop.downloads.Manifest.load(full_path)
+            if (manifest is None or not ranges or
+                    not manifest.matches(url, size, etag)):
+                manifest = plexdesktop.downloads.Manifest(
+                    full_path, plexdesktop.downloads.strip_token(url),
+                    size, etag)
+                with open(manifest.part_path, 'wb') as f:
+                    if size is not None:
+                        self._preallocate(f, size)
+            elif manifest.completed:
+                logger.info('DownloadWorker: resuming {} at {:,} of {:,} bytes'.format(
+                    file_name, manifest.completed, size))
+            manifest.save()
+            if ranges and size is not None:
+                done = self._download_ranges(job, session, url, manifest)
+            else:
+                done = self._download_single(job, session, url, manifest)
+            if done:
+                os.replace(manifest.part_path, full_path)
+                manifest.remove()
+        except (ConnectionError, requests.exceptions.RequestException,
+                OSError) as e:
+            # the part file and its manifest stay, the next try resumes
+            logger.error('DownloadWorker: {}: {}'.format(file_name, e))
+            job.error = plexdesktop.downloads.describe_error(e)
+            if manifest is not None:
+                self._save_manifest(manifest)
+            self.canceled.emit(job)
+            return
+        if not done:
+            if job.cancelled:
+                manifest.remove(part=True)
+                self.canceled.emit(job)
+            else:
+                self._save_manifest(manifest)
+            return
+        self.complete.emit(job)
+
+    @staticmethod
+    def _probe(session, url):
+        """Return the size of the file at `url`, whether the server takes
+        range requests for it and its validator (ETag or Last-Modified).
+        The size is None if it isn't known."""
+        res = session.get(url, headers={'Range': 'bytes=0-0'}, stream=True,
+                          timeout=30)
+        res.close()
+        res.raise_for_status()
+        etag = res.headers.get('ETag') or res.headers.get('Last-Modified')
+        if res.status_code == 206:
+            total = res.headers.get('Content-Range', '').rpartition('/')[2]
+            if total.isdigit():
+                return int(total), True, etag
+        length = res.headers.get('Content-Length')
+        return ((int(length) if res.status_code == 200 and length else None),
+                False, etag)
+
+    @staticmethod
+    def _save_manifest(manifest):
+        try:
+            manifest.save()
+        except OSError as e:
+            logger.error('DownloadWorker: {}: {}'.format(manifest.manifest_path, e))
+
+    def _wait_if_paused(self, job):
+        if job.paused:
+            self.paused.emit(job)
+            job.wait_while_paused()
+
+    def _split(self, gaps, segments):
+        """Cut the largest of `gaps` in half until there are `segments` of
+        them or they would be smaller than MIN_SEGMENT_SIZE."""
+        gaps = list(gaps)
+        while gaps and len(gaps) < segments:
+            first, last = max(gaps, key=lambda r: r[1] - r[0])
+            if last - first + 1 < 2 * self.MIN_SEGMENT_SIZE:
+                break
+            gaps.remove((first, last))
+            middle = first + (last - first + 1) // 2
+            gaps += [(first, middle - 1), (middle, last)]
+        return sorted(gaps)
+
+    def _download_single(self, job, session, url, manifest):
+        """Stream `url` into the part file over one connection, for servers
+        that don't take range requests. Returns False if the job was
+        cancelled or stopped."""
+        done = [0]
+
+        def fetch(i):
+            view = memoryview(bytearray(self.MAX_BLOCK))
+            with open(manifest.part_path, 'r+b', buffering=0) as f:
+                res = session.get(url, stream=True, timeout=30,
+                                  headers={'Accept-Encoding': 'identity'})
+                try:
+                    res.raise_for_status()
+                    # no way back to where it was, so the connection waits
+                    # while it's paused
+                    while not job.interrupted:
+                        self._copy(job, res, f, view, done, i)
+                        if not job.paused:
+                            break
+                        job.wait_while_paused()
+                finally:
+                    res.close()
+
+        def record():
+            manifest.ranges = [(0, done[0] - 1)] if done[0] else []
+
+        self._transfer(job, manifest, fetch, done, record)
+        if job.interrupted:
+            return False
+        if manifest.size is not None and done[0] != manifest.size:
+            raise OSError('{} is {} bytes, expected {}'.format(
+                manifest.part_path, done[0], manifest.size))
+        return True
+
+    def _download_ranges(self, job, session, url, manifest):
+        """Fetch the ranges `manifest` is missing, in parallel over up to
+        ``download_segments`` connections, each written at its offset in the
+        part file. Returns False if the job was cancelled or stopped."""
+        size = manifest.size
+        segments = max(1, int(Settings().value('download_segments', 4)))
+        ranges = self._split(manifest.missing(), segments)
+        finished_ranges = list(manifest.ranges)
+        # bytes written by each range so far
+        done = [0] * len(ranges)
+
+        def fetch(i):
+            start, end = ranges[i]
+            attempts = 0
+            view = memoryview(bytearray(self.MAX_BLOCK))
+            # unbuffered, so what `done` counts is already in the file
+            with open(manifest.part_path, 'r+b', buffering=0) as f:
+                while start + done[i] <= end and not job.interrupted:
+                    if job.paused:
+                        time.sleep(0.2)
+                        continue
+                    offset = start + done[i]
+                    try:
+                        res = session.get(url, stream=True, timeout=30, headers={
+                            'Range': 'bytes={}-{}'.format(offset, end),
+                            'Accept-Encoding': 'identity'})
+                        try:
+                            if res.status_code != 206:
+                                raise requests.exceptions.RequestException(
+                                    'range request returned {}'.format(res.status_code))
+                            f.seek(offset)
+                            self._copy(job, res, f, view, done, i, end + 1 - start)
+                        finally:
+                            res.close()
+                        if start + done[i] == offset and not job.paused:
+                            raise requests.exceptions.RequestException(
+                                'no data for bytes {}-{}'.format(offset, end))
+                    except (ConnectionError, requests.exceptions.RequestException) as e:
+                        attempts += 1
+                        if attempts >= self.SEGMENT_ATTEMPTS:
+                            raise
+                        logger.debug('DownloadWorker: retrying segment {}: {}'.format(i, e))
+                        time.sleep(attempts)
+
+        def record():
+            manifest.ranges = plexdesktop.downloads.merge_ranges(
+                finished_ranges + [(start, start + n - 1) for (start, _), n in
+                                   zip(ranges, done) if n])
+
+        self._transfer(job, manifest, fetch, done, record)
+        if job.interrupted:
+            return False
+        if manifest.missing() or os.path.getsize(manifest.part_path) != size:
+            raise OSError('{} is {} bytes, expected {}'.format(
+                manifest.part_path, os.path.getsize(manifest.part_path), size))
+        return True
+
+    def _transfer(self, job, manifest, fetch, done, record):
+        """Call ``fetch(i)`` for each counter in `done` on threads of its own.
+        The counters are the job's progress, the window reads them itself.
+        This thread only checkpoints: every ``download_sync_interval``
+        seconds what's been written is fsynced, then `record` updates the
+        manifest and it's saved, so the manifest never claims data that isn't
+        on disk. 0 skips the fsync and checkpoints every second.
+
+        If a checkpoint or a connection fails, the job is stopped so the
+        other connections give up too, instead of finishing the file first."""
+        sync_interval = float(Settings().value('download_sync_interval', 5))
+        job.progress.start(manifest.size, manifest.completed, done)
+        saved = time.monotonic()
+        try:
+            # opened for writing, fsync needs that on Windows
+            with open(manifest.part_path, 'r+b') as part, \
+                    concurrent.futures.ThreadPoolExecutor(max(1, len(done))) as pool:
+                futures = [pool.submit(fetch, i) for i in range(len(done))]
+                try:
+                    while True:
+                        finished, _ = concurrent.futures.wait(futures, timeout=0.2)
+                        for future in finished:
+                            future.result()
+                        now = time.monotonic()
+                        if len(finished) == len(futures):
+                            break
+                        if now - saved > max(sync_interval, 1.0):
+                            saved = now
+                            record()
+                            if sync_interval > 0:
+                                os.fsync(part.fileno())
+                            self._save_manifest(manifest)
+                        self._wait_if_paused(job)
+                except BaseException:
+                    job.stop()
+                    raise
+                for future in futures:
+                    future.result()  # raises the error of a segment that gave up
+        finally:
+            record()
+
+    def _copy(self, job, res, f, view, done, i, length=None):
+        """Write the body of `res` to `f` from its current position, reading
+        it straight into the buffer `view` and writing from there, so the
+        data isn't copied into a bytes object per block. ``done[i]`` counts
+        the bytes written. Stops after `length` of them, at the end of the
+        body, or when the job is paused or interrupted.
+
+        Blocks grow while reads fill them, the data arrives faster than it's
+        written, and shrink while they come back short. Under a bandwidth
+        limit they stay small enough to keep the rate smooth.
+        """
+        readinto = self._reader(res)
+        limit = min([max(4096, bucket.rate // 10) for bucket in job.buckets
+                     if bucket.rate] + [self.MAX_BLOCK])
+        block = min(self.MIN_BLOCK, limit)
+        while length is None or done[i] < length:
+            want = block if length is None else min(block, length - done[i])
+            try:
+                n = readinto(view[:want])
+            except (OSError, http.client.HTTPException,
+                    urllib3.exceptions.HTTPError) as e:
+                # what requests would have raised, so the segment retries
+                raise requests.exceptions.ConnectionError(e)
+            if not n:
+                break
+            written = 0
+            while written < n:
+                written += f.write(view[written:n])
+            done[i] += n
+            job.throttle(n)
+            if n == block:
+                block = min(block * 2, limit)
+            elif n < block // 2:
+                block = max(block // 2, min(self.MIN_BLOCK, limit))
+            if job.paused or job.interrupted:
+                break
+
+    @staticmethod
+    def _reader(res):
+        """The ``readinto`` of the http.client response under `res`, which
+        reads from the socket into the buffer it's given. urllib3's copies
+        through a bytes object of its own, and is used if the http.client
+        one isn't there."""
+        readinto = getattr(getattr(res.raw, '_fp', None), 'readinto', None)
+        if readinto is not None and not res.headers.get('Content-Encoding'):
+            return readinto
+        return res.raw.readinto
+
+    @staticmethod
+    def _preallocate(f, size):
+        """Reserve `size` bytes for `f` up front, so the file doesn't
+        fragment as ranges land out of order and a full disk shows up now
+        rather than halfway. Falls back to a sparse file where the file
+        system can't."""
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+        except AttributeError:
+            f.truncate(size)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                raise
+            f.truncate(size)
+
+
+class DownloadTask(QtCore.QRunnable):
+    """Run one :class:`DownloadJob` on a :class:`DownloadScheduler` thread."""
+
+    def __init__(self, scheduler, job):
+        super().__init__()
+        self.scheduler = scheduler
+        self.job = job
+        self.setAutoDelete(True)
+
+    def run(self):
+        try:
+            self.scheduler.worker.download(self.job)
+        except Exception as e:
+            logger.error('DownloadTask: {}: {}'.format(self.job.item, e))
+            self.scheduler.worker.canceled.emit(self.job)
+        finally:
+            self.scheduler.task_done.emit(self.job)
+
+
+class DownloadScheduler(QtCore.QObject):
+    """Decide which downloads run, and how fast.
+
+    Up to ``download_concurrent`` jobs run at once, at most
+    ``download_per_server`` of them from the same server. Waiting jobs start
+    in order: higher priority first, then in the order they were added,
+    unless they were moved. Paused jobs that haven't started are passed over.
+    All downloads share one bandwidth limit, and each server has its own.
+    """
+    task_done = QtCore.pyqtSignal(DownloadJob)
+    started = QtCore.pyqtSignal(DownloadJob)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.worker = DownloadWorker()
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(64)  # the limits are kept by _dispatch
+        self.queue = []  # waiting jobs, in the order they start
+        self.running = []
+        self.bucket = plexdesktop.downloads.TokenBucket()
+        self.server_buckets = {}
+        self.configure()
+        self.task_done.connect(self._task_done, QtCore.Qt.QueuedConnection)
+
+    def configure(self):
+        """Apply the download settings, then start what they allow."""
+        s = Settings()
+        self.max_downloads = max(1, int(s.value('download_concurrent', 2)))
+        self.max_per_server = max(1, int(s.value('download_per_server', 2)))
+        self.bucket.set_rate(plexdesktop.downloads.rate_limit('download_limit_kb'))
+        server_rate = plexdesktop.downloads.rate_limit('download_server_limit_kb')
+        for bucket in self.server_buckets.values():
+            bucket.set_rate(server_rate)
+        self._dispatch()
+
+    def jobs(self):
+        """every job, running ones first, the rest in the order they start"""
+        return self.running + self.queue
+
+    def add(self, job):
+        """Queue `job` after the waiting jobs of the same or higher
+        priority."""
+        index = len(self.queue)
+        while index > 0 and self.queue[index - 1].priority < job.priority:
+            index -= 1
+        self.queue.insert(index, job)
+        job.resumed.connect(self._dispatch)
+        self._dispatch()
+
+    def move(self, job, offset):
+        """Move a waiting `job` `offset` places, up if it's negative. It takes
+        the priority of the job it's moved next to so it stays there."""
+        if job not in self.queue:
+            return
+        index = self.queue.index(job)
+        new = max(0, min(len(self.queue) - 1, index + offset))
+        if new == index:
+            return
+        self.queue.insert(new, self.queue.pop(index))
+        job.priority = self.queue[new + 1 if offset < 0 else new - 1].priority
+        self._dispatch()
+
+    def cancel(self, job):
+        if job in self.queue or (job.error is not None and job not in self.running):
+            # not running, either waiting or failed
+            if job in self.queue:
+                self.queue.remove(job)
+            job.cancelled = True
+            self.worker.canceled.emit(job)
+        else:
+            job.cancel()
+
+    def quit(self):
+        """Stop every download so it can carry on next time."""
+        for job in self.queue + self.running:
+            job.stop()
+        self.queue.clear()
+        self.pool.waitForDone(5000)
+
+    def _server_bucket(self, server):
+        try:
+            return self.server_buckets[server]
+        except KeyError:
+            bucket = plexdesktop.downloads.TokenBucket(
+                plexdesktop.downloads.rate_limit('download_server_limit_kb'))
+            self.server_buckets[server] = bucket
+            return bucket
+
+    def _next(self):
+        per_server = collections.Counter(job.server for job in self.running)
+        for job in self.queue:
+            if not job.paused and per_server[job.server] < self.max_per_server:
+                return job
+        return None
+
+    def _dispatch(self):
+        while len(self.running) < self.max_downloads:
+            job = self._next()
+            if job is None:
+                break
+            self.queue.remove(job)
+            self.running.append(job)
+            job.buckets = (self.bucket, self._server_bucket(job.server))
+            self.pool.start(DownloadTask(self, job))
+            self.started.emit(job)
+
+    def _task_done(self, job):
+        try:
+            self.running.remove(job)
+        except ValueError:
+            pass
+        self._dispatch()